@@ -0,0 +1,159 @@
+"""Compares OCR latency and extraction accuracy of the full and fast parse_ocr paths.
+
+Point it at a folder of screenshots. Each screenshot needs a ground-truth file
+next to it with the same name and a .json extension, holding the minutes per app:
+
+    Screenshot_20250114.png
+    Screenshot_20250114.json   {"apps": {"youtube": 65, "instagram": 40, "chrome": 12}}
+
+Run:
+
+    python bench_ocr.py screenshots/ --repeat 3 --json ocr_report.json
+
+--batch-sizes 1,2,4,8 also OCRs the whole folder through read_texts at each batch
+size and reports the per-image latency; batch size 1 is the sequential baseline.
+"""
+import argparse
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+from PIL import Image
+
+import detox_ocr
+
+
+IMAGE_SUFFIXES = {'.png', '.jpg', '.jpeg'}
+MODES = {'full': False, 'fast': True}
+
+
+def load_samples(folder):
+    samples = []
+    for path in sorted(Path(folder).iterdir()):
+        truth_path = path.with_suffix('.json')
+        if path.suffix.lower() not in IMAGE_SUFFIXES or not truth_path.exists():
+            continue
+        apps = {name.lower(): minutes for name, minutes in json.loads(truth_path.read_text())['apps'].items()}
+        samples.append((path, Image.open(path).convert('RGB'), apps))
+    return samples
+
+
+def score(app_times, truth):
+    """Share of ground-truth apps read with the exact minutes, and total-minutes error."""
+    correct = sum(1 for app, minutes in truth.items() if app_times.get(app) == minutes)
+    return {
+        'app_accuracy': correct / len(truth) if truth else 1.0,
+        'total_error': abs(sum(app_times.values()) - sum(truth.values())),
+    }
+
+
+def run(samples, repeat):
+    rows = []
+    for path, image, truth in samples:
+        for mode, fast in MODES.items():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                texts = detox_ocr.read_text(image, fast)
+                timings.append(time.perf_counter() - start)
+            _, _, _, app_times = detox_ocr.parse_usage(texts)
+            rows.append({'image': path.name, 'mode': mode, 'seconds': min(timings), **score(app_times, truth)})
+    return rows
+
+
+def run_batched(samples, batch_sizes, repeat):
+    """Per-image latency and accuracy of read_texts over all samples, per mode and batch size."""
+    images = [image for _, image, _ in samples]
+    rows = []
+    for mode, fast in MODES.items():
+        for batch_size in batch_sizes:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                found = detox_ocr.read_texts(images, fast, batch_size)
+                timings.append(time.perf_counter() - start)
+            scores = [score(detox_ocr.parse_usage(texts)[3], truth) for texts, (_, _, truth) in zip(found, samples)]
+            rows.append({
+                'mode': mode,
+                'batch_size': batch_size,
+                'seconds_per_image': min(timings) / len(images),
+                'mean_app_accuracy': statistics.mean(s['app_accuracy'] for s in scores),
+            })
+    for row in rows:
+        sequential = next((r for r in rows if r['mode'] == row['mode'] and r['batch_size'] == 1), None)
+        row['speedup'] = sequential['seconds_per_image'] / row['seconds_per_image'] if sequential else None
+    return rows
+
+
+def summarize(rows):
+    summary = {}
+    for mode in MODES:
+        mode_rows = [r for r in rows if r['mode'] == mode]
+        if not mode_rows:
+            continue
+        summary[mode] = {
+            'images': len(mode_rows),
+            'median_seconds': statistics.median(r['seconds'] for r in mode_rows),
+            'mean_app_accuracy': statistics.mean(r['app_accuracy'] for r in mode_rows),
+            'mean_total_error': statistics.mean(r['total_error'] for r in mode_rows),
+        }
+    if 'full' in summary and 'fast' in summary and summary['fast']['median_seconds']:
+        summary['speedup'] = summary['full']['median_seconds'] / summary['fast']['median_seconds']
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('folder', help="folder of screenshots with .json ground truth next to them")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per image and mode; the fastest is reported")
+    parser.add_argument('--batch-sizes', help="comma-separated batch sizes to compare, e.g. 1,2,4,8")
+    parser.add_argument('--json', help="also write the per-image rows and summary to this file")
+    args = parser.parse_args(argv)
+
+    samples = load_samples(args.folder)
+    if not samples:
+        sys.exit(f"No screenshots with ground truth found in {args.folder}")
+
+    # Measure OCR, not the cache or the one-off model load.
+    detox_ocr.OCR_CACHE_PATH = ""
+    detox_ocr.get_ocr_reader()
+    engine = detox_ocr.ocr_engine_info()
+    print(f"OCR engine loaded in {engine['load_seconds']:.1f}s")
+
+    rows = run(samples, args.repeat)
+    summary = summarize(rows)
+
+    print(f"{'image':<40} {'mode':<5} {'seconds':>8} {'apps ok':>8} {'total err':>10}")
+    for r in rows:
+        print(f"{r['image']:<40} {r['mode']:<5} {r['seconds']:>8.3f} {r['app_accuracy']:>8.0%} {r['total_error']:>10}")
+    print()
+    for mode in MODES:
+        if mode in summary:
+            m = summary[mode]
+            print(f"{mode:<5} median {m['median_seconds']:.3f}s | app accuracy {m['mean_app_accuracy']:.0%} | "
+                  f"mean total error {m['mean_total_error']:.1f} min")
+    if 'speedup' in summary:
+        print(f"fast mode is {summary['speedup']:.2f}x the speed of the full path")
+
+    batched = []
+    if args.batch_sizes:
+        batched = run_batched(samples, [int(size) for size in args.batch_sizes.split(',')], args.repeat)
+        try:
+            import torch
+            threads = f" ({torch.get_num_threads()} CPU threads)" if not engine.get('gpu') else " (GPU)"
+        except ImportError:
+            threads = ""
+        print(f"\nbatched over {len(samples)} images{threads}")
+        print(f"{'mode':<5} {'batch':>5} {'s/image':>8} {'speedup':>8} {'apps ok':>8}")
+        for r in batched:
+            speedup = f"{r['speedup']:.2f}x" if r['speedup'] else "-"
+            print(f"{r['mode']:<5} {r['batch_size']:>5} {r['seconds_per_image']:>8.3f} {speedup:>8} {r['mean_app_accuracy']:>8.0%}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({'engine': engine, 'rows': rows, 'summary': summary, 'batched': batched}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
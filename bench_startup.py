@@ -0,0 +1,86 @@
+"""Measures the cold-start import cost of the Streamlit app against a time budget.
+
+Each run imports detoxmain in a fresh interpreter with -X importtime, the way a
+new Streamlit worker would, and reports the slowest top-level imports. It fails
+if the median import takes longer than the budget or if any module that should
+only load on first use (OCR, pandas, plotting, NumPy) was pulled in at startup.
+
+    python bench_startup.py
+    python bench_startup.py --runs 5 --budget 1.0 --json startup_report.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+
+DEFAULT_BUDGET_SECONDS = float(os.environ.get("DETOX_STARTUP_BUDGET", 1.5))
+LAZY_MODULES = ('easyocr', 'torch', 'pandas', 'plotly.express', 'numpy', 'sklearn')
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import detoxmain
+seconds = time.perf_counter() - start
+print(json.dumps({'seconds': seconds, 'loaded': [m for m in %r if m in sys.modules]}))
+""" % (LAZY_MODULES,)
+
+
+def measure_once():
+    # The repo goes first, ahead of (not instead of) whatever path streamlit was installed on.
+    python_path = [str(Path(__file__).resolve().parent)] + ([os.environ['PYTHONPATH']] if os.environ.get('PYTHONPATH') else [])
+    env = dict(os.environ, DETOX_OCR_PRELOAD="0", PYTHONPATH=os.pathsep.join(python_path))
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', PROBE],
+                          capture_output=True, text=True, env=env, check=True)
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    # importtime lines: "import time: self [us] | cumulative | imported package", nested two
+    # spaces per level. Depth 1 is what detoxmain imports directly.
+    direct = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            direct.append((name.strip(), int(cumulative) / 1e6))
+    result['top_imports'] = sorted(direct, key=lambda item: item[1], reverse=True)[:10]
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET_SECONDS, help="max median import seconds")
+    parser.add_argument('--json', help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    runs = [measure_once() for _ in range(args.runs)]
+    median = statistics.median(r['seconds'] for r in runs)
+    loaded = sorted({m for r in runs for m in r['loaded']})
+
+    print(f"import detoxmain: median {median * 1000:.0f} ms over {args.runs} runs "
+          f"(min {min(r['seconds'] for r in runs) * 1000:.0f} ms, budget {args.budget * 1000:.0f} ms)")
+    print("slowest imports made by detoxmain (last run):")
+    for name, seconds in runs[-1]['top_imports']:
+        print(f"  {seconds * 1000:8.1f} ms  {name}")
+
+    failures = []
+    if median > args.budget:
+        failures.append(f"median import time {median:.2f}s is over the {args.budget:.2f}s budget")
+    if loaded:
+        failures.append(f"loaded at startup but should be lazy: {', '.join(loaded)}")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps({'median_seconds': median, 'budget_seconds': args.budget,
+                                               'runs': runs, 'failures': failures}, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""Times Detoxify's hot paths on synthetic screenshots and a seeded database.
+
+Everything is generated from --seed, so two runs with the same arguments measure
+the same work:
+
+  * "Digital Wellbeing" screenshots rendered with PIL at several resolutions and
+    app-list lengths, each with a .json ground truth (the format bench_ocr.py reads);
+  * a SQLite database with --users users and --days days of daily_logs and
+    challenges_log, plus the derived progress, trend and leaderboard tables.
+
+It then times parse_ocr, the usage parser alone, check_challenges, the dashboard
+history query, the prediction path and the leaderboard reads, and writes a JSON report. Pass an older
+report to --compare to flag stages whose median got slower than --tolerance.
+
+    python bench_suite.py --users 200 --days 90 --json bench_baseline.json
+    python bench_suite.py --users 200 --days 90 --json bench_new.json --compare bench_baseline.json
+"""
+import argparse
+import json
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFont
+
+import detox_db
+import detox_ocr
+from detox_challenges import CHALLENGES, check_challenges, passes_challenge, rebuild_challenge_progress
+from detox_core import default_history_range, get_history_bounds, get_history_rollup
+from detox_db import init_db, run_many, run_query, transaction
+from detox_forecast import forecast_from_stats, get_recent_totals, get_trend_stats, rebuild_trend_stats
+from detox_leaderboard import ALL_TIME, current_week, get_leaderboard, get_my_rank, rebuild_weekly_stats
+from detox_usage import backfill_app_usage
+
+
+APP_NAMES = ['YouTube', 'Instagram', 'WhatsApp', 'Chrome', 'Spotify', 'Gmail', 'Maps', 'Netflix', 'Snapchat',
+             'Telegram', 'Twitter', 'Reddit', 'LinkedIn', 'Amazon', 'Photos', 'Camera', 'Settings', 'Calendar',
+             'Discord', 'Pinterest']
+RESOLUTIONS = ((720, 1600), (1080, 2400), (1440, 3200))
+APP_COUNTS = (3, 8, 15)
+BENCH_USER_PREFIX = 'bench_user_'
+PARSE_REPEAT = 200
+# Read-only stages are repeated up to at least this many calls, so their p50 is steady.
+READ_MIN_CALLS = 200
+# Below this many calls in either report a stage is shown but can't fail the comparison.
+GATE_MIN_CALLS = 20
+# OCR passes per screenshot: too slow to repeat like the read-only stages, but 9 calls are too few.
+OCR_REPEAT = 3
+
+
+def format_minutes(minutes):
+    h, m = divmod(minutes, 60)
+    return " ".join(part for part in (f"{h}h" if h else "", f"{m}m" if m else "") if part)
+
+
+def _font(size):
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 only has the small bitmap font
+        return ImageFont.load_default()
+
+
+def render_screenshot(width, height, apps, day):
+    """A Digital Wellbeing style summary: date header, total, usage chart and one row per app.
+
+    Rows that don't fit on the screen are left off, as on a phone; returns the image and
+    the apps actually drawn.
+    """
+    scale = width / 1080
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    margin = int(60 * scale)
+
+    total = sum(apps.values())
+    draw.text((margin, int(80 * scale)), day.strftime("%A, %d %B"), fill='#444444', font=_font(int(40 * scale)))
+    draw.text((margin, int(160 * scale)), "Screen time", fill='#222222', font=_font(int(56 * scale)))
+    draw.text((margin, int(250 * scale)), f"{total // 60} hrs, {total % 60} mins", fill='#111111', font=_font(int(72 * scale)))
+
+    chart_top, chart_bottom = int(400 * scale), int(800 * scale)
+    bar_width = (width - 2 * margin) // 12
+    biggest = max(apps.values())
+    for i, minutes in enumerate(list(apps.values())[:10]):
+        left = margin + i * (bar_width + bar_width // 5)
+        top = chart_bottom - int((chart_bottom - chart_top) * minutes / biggest)
+        draw.rectangle((left, top, left + bar_width, chart_bottom), fill='#4a7bd0')
+
+    row_height = int(150 * scale)
+    name_font, time_font = _font(int(44 * scale)), _font(int(40 * scale))
+    drawn = {}
+    y = chart_bottom + int(80 * scale)
+    for name, minutes in apps.items():
+        if y + row_height > height:
+            break
+        icon = int(90 * scale)
+        draw.ellipse((margin, y, margin + icon, y + icon), fill='#cccccc')
+        draw.text((margin + icon + int(40 * scale), y + int(20 * scale)), name, fill='#111111', font=name_font)
+        label = format_minutes(minutes)
+        label_width = draw.textlength(label, font=time_font)
+        draw.text((width - margin - label_width, y + int(24 * scale)), label, fill='#555555', font=time_font)
+        drawn[name] = minutes
+        y += row_height
+    return image, drawn
+
+
+def generate_screenshots(folder, rng, resolutions=RESOLUTIONS, app_counts=APP_COUNTS):
+    """Writes one screenshot (and its .json truth) per resolution and app count; returns their paths."""
+    folder.mkdir(parents=True, exist_ok=True)
+    samples = []
+    day = date(2025, 1, 14)
+    for width, height in resolutions:
+        for count in app_counts:
+            apps = {name: rng.randint(1, 240) for name in rng.sample(APP_NAMES, count)}
+            apps = dict(sorted(apps.items(), key=lambda item: item[1], reverse=True))
+            image, drawn = render_screenshot(width, height, apps, day)
+            path = folder / f"Screenshot_{day:%Y%m%d}_{width}x{height}_{count}apps.png"
+            image.save(path)
+            path.with_suffix('.json').write_text(json.dumps({'apps': drawn, 'date': day.isoformat()}))
+            samples.append(path)
+            day += timedelta(days=1)
+    return samples
+
+
+def seed_database(users, days, rng):
+    """Fills the (empty) benchmark database; returns the seeded usernames and row counts."""
+    init_db()
+    end = date.today() - timedelta(days=1)
+    usernames = [f"{BENCH_USER_PREFIX}{i:05d}" for i in range(users)]
+    log_rows = challenge_rows = 0
+    start = time.perf_counter()
+    with transaction():
+        run_many("INSERT INTO users (username, password, points, balance_inr, baseline_screentime) VALUES (?, ?, 0, 0.0, ?)",
+                 [(name, "", rng.randint(180, 420)) for name in usernames])
+        for name in usernames:
+            baseline = run_query("SELECT baseline_screentime FROM users WHERE username = ?", (name,), fetch=True)[0][0]
+            level = baseline * rng.uniform(0.6, 1.1)
+            logs, passed = [], []
+            for offset in range(days - 1, -1, -1):
+                day = (end - timedelta(days=offset)).isoformat()
+                level = max(30, level + rng.gauss(-0.5, 20))
+                total = int(level)
+                log = {'total': total, 'youtube': int(total * rng.uniform(0.1, 0.5)), 'instagram': int(total * rng.uniform(0.05, 0.3))}
+                logs.append((name, day, log['total'], log['youtube'], log['instagram']))
+                passed += [(name, cid, day) for cid, challenge in CHALLENGES.items() if passes_challenge(challenge, log, baseline)]
+            run_many("INSERT INTO daily_logs VALUES (?, ?, ?, ?, ?)", logs)
+            run_many("INSERT INTO challenges_log VALUES (?, ?, ?)", passed)
+            log_rows += len(logs)
+            challenge_rows += len(passed)
+        backfill_app_usage()
+        rebuild_challenge_progress()
+        rebuild_trend_stats()
+        rebuild_weekly_stats()
+    seconds = time.perf_counter() - start
+    return usernames, {'users': users, 'daily_logs': log_rows, 'challenges_log': challenge_rows,
+                       'seconds': seconds, 'rows_per_second': (log_rows + challenge_rows) / seconds if seconds else 0.0}
+
+
+def summarize_timings(timings):
+    ordered = sorted(timings)
+    return {
+        'calls': len(ordered),
+        'p50_ms': statistics.median(ordered) * 1000,
+        'p95_ms': ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))] * 1000,
+        'mean_ms': statistics.mean(ordered) * 1000,
+    }
+
+
+def time_calls(func, args_list):
+    timings = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_ocr(samples):
+    """parse_ocr on every screenshot (OCR engine included), scored against the ground truth."""
+    detox_ocr.OCR_CACHE_PATH = ""  # measure OCR, not the cache
+    detox_ocr.get_ocr_reader()
+    timings, exact = [], 0
+    for path in samples:
+        truth = json.loads(path.with_suffix('.json').read_text())['apps']
+        image = Image.open(path).convert('RGB')
+        for _ in range(OCR_REPEAT):
+            start = time.perf_counter()
+            total, youtube, instagram, _ = detox_ocr.parse_ocr(image, False)
+            timings.append(time.perf_counter() - start)
+        exact += (total, youtube, instagram) == (sum(truth.values()), truth.get('YouTube', 0), truth.get('Instagram', 0))
+    return timings, {'screenshots': len(samples), 'exact_matches': exact, 'load_seconds': detox_ocr.ocr_engine_info()['load_seconds']}
+
+
+def bench_parse_usage(samples):
+    """The regex parsing loop alone, on the strings OCR would ideally return."""
+    text_lists = []
+    for path in samples:
+        truth = json.loads(path.with_suffix('.json').read_text())['apps']
+        text_lists.append(["Screen time", "3 hrs, 25 mins"] + [s for name, minutes in truth.items() for s in (name, format_minutes(minutes))])
+    return time_calls(detox_ocr.parse_usage, [(texts,) for texts in text_lists] * PARSE_REPEAT)
+
+
+def bench_prediction(username):
+    trend = get_trend_stats(username)
+    if trend is not None:
+        forecast_from_stats.cache_clear()  # time the fit, not the cache
+        forecast_from_stats(*trend)
+        get_recent_totals(username, trend[5])
+
+
+def repeated(args_list, repeat):
+    """args_list repeat times over, or more if that's needed to reach READ_MIN_CALLS calls."""
+    return args_list * max(repeat, -(-READ_MIN_CALLS // max(1, len(args_list))))
+
+
+def dashboard_query(username):
+    """get_history_rollup arguments for the Dashboard's opening view of a user: daily bars over the default range."""
+    first, last = (date.fromisoformat(day) for day in get_history_bounds(username))
+    start, end = default_history_range(first, last)
+    return username, 'day', start.isoformat(), end.isoformat()
+
+
+def compare(report, baseline, tolerance, min_delta_ms):
+    """Prints p50 changes against an older report; returns the stages that regressed.
+
+    A stage regresses when its p50 grew by more than tolerance and by more than
+    min_delta_ms, over at least GATE_MIN_CALLS calls in both reports. For stages
+    that take microseconds, identical runs differ by more than any sane ratio.
+    """
+    regressions = []
+    print(f"\n{'stage':<22} {'old p50':>10} {'new p50':>10} {'change':>8}")
+    for name, stage in report['stages'].items():
+        old = baseline.get('stages', {}).get(name)
+        if not old or not old['p50_ms']:
+            continue
+        ratio = stage['p50_ms'] / old['p50_ms']
+        flag = ""
+        if ratio > 1 + tolerance and stage['p50_ms'] - old['p50_ms'] > min_delta_ms:
+            if min(stage['calls'], old.get('calls', 0)) < GATE_MIN_CALLS:
+                flag = "  (too few calls to judge)"
+            else:
+                flag = "  REGRESSION"
+                regressions.append(name)
+        print(f"{name:<22} {old['p50_ms']:>8.3f}ms {stage['p50_ms']:>8.3f}ms {ratio - 1:>+7.0%}{flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workdir', default='bench_data', help="where screenshots and the database are generated")
+    parser.add_argument('--db', help="benchmark database, recreated every run (default: WORKDIR/bench_users.db)")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--days', type=int, default=60, help="days of daily_logs per user")
+    parser.add_argument('--sample-users', type=int, default=50, help="users timed for the per-user stages")
+    parser.add_argument('--repeat', type=int, default=5, help="passes over the sampled users for the read-only stages")
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--skip-ocr', action='store_true', help="don't load the OCR engine; time the parser only")
+    parser.add_argument('--json', help="write the report to this file")
+    parser.add_argument('--compare', help="an earlier report to check for regressions")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="allowed p50 slowdown before a stage fails, e.g. 0.25 = 25%%")
+    parser.add_argument('--min-delta-ms', type=float, default=0.05, help="p50 slowdowns smaller than this never fail a stage")
+    args = parser.parse_args(argv)
+
+    workdir = Path(args.workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    db_path = Path(args.db) if args.db else workdir / 'bench_users.db'
+    if db_path.exists():
+        check = sqlite3.connect(db_path)
+        try:
+            foreign = check.execute("SELECT COUNT(*) FROM users WHERE username NOT LIKE ?", (BENCH_USER_PREFIX + '%',)).fetchone()[0]
+        except sqlite3.OperationalError:
+            foreign = 0
+        finally:
+            check.close()
+        if foreign:
+            sys.exit(f"{db_path} has users the benchmark didn't create; refusing to overwrite it")
+        for suffix in ('', '-wal', '-shm'):
+            Path(f"{db_path}{suffix}").unlink(missing_ok=True)
+    detox_db.DB_PATH = str(db_path)
+    rng = random.Random(args.seed)
+
+    samples = generate_screenshots(workdir / 'screenshots', rng)
+    print(f"Rendered {len(samples)} screenshots into {workdir / 'screenshots'}")
+    usernames, seeded = seed_database(args.users, args.days, rng)
+    print(f"Seeded {seeded['users']} users, {seeded['daily_logs']} daily_logs and {seeded['challenges_log']} challenges_log rows "
+          f"in {seeded['seconds']:.1f}s ({seeded['rows_per_second']:.0f} rows/s)")
+    sampled = rng.sample(usernames, min(args.sample_users, len(usernames)))
+
+    stages, ocr = {}, None
+    if not args.skip_ocr:
+        timings, ocr = bench_ocr(samples)
+        stages['parse_ocr'] = timings
+    stages['parse_usage'] = bench_parse_usage(samples)
+    per_user = [(name,) for name in sampled]
+    dashboard = [dashboard_query(name) for name in sampled]
+    time_calls(get_history_rollup, dashboard)  # warm the page cache and connection first
+    time_calls(bench_prediction, per_user)
+    stages['dashboard_daily'] = time_calls(get_history_rollup, repeated(dashboard, args.repeat))
+    stages['dashboard_weekly'] = time_calls(get_history_rollup, repeated([(name, 'week') for name in sampled], args.repeat))
+    stages['prediction'] = time_calls(bench_prediction, repeated(per_user, args.repeat))
+    boards = [(board, week) for board in ('points', 'reduction') for week in (ALL_TIME, current_week())]
+    stages['leaderboard_top'] = time_calls(get_leaderboard, repeated(boards, args.repeat))
+    stages['leaderboard_rank'] = time_calls(get_my_rank, repeated([(name, board, week) for name in sampled for board, week in boards], 1))
+    # Last: it writes. Each sampled user logs one more day, today.
+    today = date.today().isoformat()
+    stages['check_challenges'] = time_calls(check_challenges, [(name, {'total': 100, 'youtube': 30, 'instagram': 20}, today) for name in sampled])
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {key: getattr(args, key) for key in ('users', 'days', 'sample_users', 'repeat', 'seed', 'skip_ocr')},
+        'seed': seeded,
+        'ocr': ocr,
+        'stages': {name: summarize_timings(timings) for name, timings in stages.items()},
+    }
+
+    print(f"\n{'stage':<22} {'calls':>6} {'p50':>10} {'p95':>10}")
+    for name, stage in report['stages'].items():
+        print(f"{name:<22} {stage['calls']:>6} {stage['p50_ms']:>8.3f}ms {stage['p95_ms']:>8.3f}ms")
+    if ocr:
+        print(f"parse_ocr read {ocr['exact_matches']}/{ocr['screenshots']} screenshots exactly (engine loaded in {ocr['load_seconds']:.1f}s)")
+
+    regressions = []
+    if args.compare:
+        regressions = compare(report, json.loads(Path(args.compare).read_text()), args.tolerance, args.min_delta_ms)
+        report['regressions'] = regressions
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+    if regressions:
+        print(f"FAIL: slower than {args.compare} by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import time
+from datetime import datetime
+
+from detox_db import bump_state_version, run_query, run_many, transaction, user_filter
+from detox_ledger import post_entries
+from detox_metrics import timed
+from detox_usage import get_day_usage
+
+
+CHALLENGES = {
+    "C1": {
+        "title": "The 10% Cut",
+        "desc": "Reduce screentime by 10% per day for 1 week.",
+        "points": 25,
+        "difficulty": "EASY",
+        "days": 7,
+        "reward_text": "+25 pts/week",
+        "metric": "total",
+        "baseline_factor": 0.9
+    },
+    "C2": {
+        "title": "YouTube Diet",
+        "desc": "Keep YouTube under 3 hours per day for 2 weeks.",
+        "points": 50,
+        "difficulty": "MEDIUM",
+        "days": 14,
+        "reward_text": "+50 pts/2 weeks",
+        "metric": "youtube",
+        "limit": 180
+    },
+    "C3": {
+        "title": "Monk Mode",
+        "desc": "Total screentime under 2 hours per day for 1 month.",
+        "points": 100,
+        "difficulty": "HARD",
+        "days": 30,
+        "reward_text": "+100 pts/1 month",
+        "metric": "total",
+        "limit": 120
+    },
+    "C4": {
+        "title": "Reel Rehab",
+        "desc": "Keep Instagram under 3 hours per day for 2 weeks.",
+        "points": 50,
+        "difficulty": "MEDIUM",
+        "days": 14,
+        "reward_text": "+50 pts/2 weeks",
+        "metric": "instagram",
+        "limit": 180
+    }
+}
+
+
+# Each rule: the metric must stay at or under its limit on a day with data. The metric is "total",
+# "youtube", "instagram" or any other app name as stored in app_usage (e.g. "whatsapp"). The limit
+# is either fixed ("limit", minutes) or relative to the user's baseline ("baseline_factor").
+def challenge_limit(challenge, baseline):
+    if 'baseline_factor' in challenge:
+        return baseline * challenge['baseline_factor']
+    return challenge['limit']
+
+
+def metric_value(challenge, log):
+    metric = challenge['metric']
+    if metric in log:
+        return log[metric]
+    return log.get('app_times', {}).get(metric, 0)
+
+
+def passes_challenge(challenge, log, baseline):
+    return log['total'] > 0 and metric_value(challenge, log) <= challenge_limit(challenge, baseline)
+
+
+def get_challenge_progress(username, date_str):
+    """Progress per challenge from challenge_progress, plus whether date_str is already done.
+
+    One query; every lookup in it is a primary-key probe, so the cost doesn't grow with history.
+    """
+    rows = run_query('''SELECT p.challenge_id, p.days_completed, p.streak, p.last_date, p.claimed,
+                               EXISTS (SELECT 1 FROM challenges_log c
+                                       WHERE c.username = p.username AND c.challenge_id = p.challenge_id AND c.date = ?)
+                        FROM challenge_progress p WHERE p.username = ?''', (date_str, username), fetch=True)
+    progress = {cid: {'days': 0, 'streak': 0, 'last_date': None, 'claimed': False, 'done': False} for cid in CHALLENGES}
+    for cid, days, streak, last_date, claimed, done in rows:
+        progress[cid] = {'days': days, 'streak': streak, 'last_date': last_date, 'claimed': bool(claimed), 'done': bool(done)}
+    return progress
+
+
+@timed("challenges.check")
+def check_challenges(username, today_log, date_str=None):
+    """Evaluates every rule in CHALLENGES for one day's log and awards finished challenges.
+
+    Two reads, then, if the day passes any challenge, one transaction of at most six writes,
+    however many challenges exist. Returns the ids completed.
+    """
+    baseline = run_query("SELECT baseline_screentime FROM users WHERE username = ?", (username,), fetch=True)
+    baseline = baseline[0][0] if baseline else 300
+    today_str = date_str or datetime.now().strftime("%Y-%m-%d")
+    progress = get_challenge_progress(username, today_str)
+
+    passed = [cid for cid, challenge in CHALLENGES.items()
+              if not progress[cid]['done'] and passes_challenge(challenge, today_log, baseline)]
+    if not passed:
+        return []
+
+    completed = [cid for cid in passed
+                 if not progress[cid]['claimed'] and progress[cid]['days'] + 1 >= CHALLENGES[cid]["days"]]
+    with transaction():
+        run_many("INSERT INTO challenges_log VALUES (?, ?, ?)", [(username, cid, today_str) for cid in passed])
+        # A day logged out of order can't tell whether it joins the streak; rebuild_challenge_progress settles it.
+        run_many('''INSERT INTO challenge_progress (username, challenge_id, days_completed, streak, last_date, claimed)
+                    VALUES (?, ?, 1, 1, ?, ?)
+                    ON CONFLICT (username, challenge_id) DO UPDATE SET
+                        days_completed = days_completed + 1,
+                        streak = CASE
+                            WHEN julianday(excluded.last_date) - julianday(last_date) = 1 THEN streak + 1
+                            WHEN excluded.last_date < last_date THEN streak
+                            ELSE 1 END,
+                        last_date = MAX(COALESCE(last_date, excluded.last_date), excluded.last_date),
+                        claimed = MAX(claimed, excluded.claimed)''',
+                 [(username, cid, today_str, int(cid in completed)) for cid in passed])
+        if completed:
+            post_entries([(username, 'challenge', CHALLENGES[cid]["points"], 0.0, cid) for cid in completed])
+        bump_state_version([username])
+    return completed
+
+
+def get_challenge_status(username, baseline, date_str):
+    """Everything the Challenges page shows, per challenge, from two queries."""
+    log_data = run_query("SELECT total_minutes, youtube_minutes, instagram_minutes FROM daily_logs WHERE username = ? AND date = ?", (username, date_str), fetch=True)
+    total, youtube, instagram = log_data[0] if log_data else (0, 0, 0)
+    today_log = {'total': total, 'youtube': youtube, 'instagram': instagram}
+    if any(challenge['metric'] not in today_log for challenge in CHALLENGES.values()):
+        today_log['app_times'] = get_day_usage(username, date_str)
+    progress = get_challenge_progress(username, date_str)
+
+    status = []
+    for cid, challenge in CHALLENGES.items():
+        limit = challenge_limit(challenge, baseline)
+        today_val = metric_value(challenge, today_log)
+        status.append({
+            'id': cid,
+            'challenge': challenge,
+            'days_completed': progress[cid]['days'],
+            'streak': progress[cid]['streak'],
+            'claimed': progress[cid]['claimed'],
+            'done_today': progress[cid]['done'],
+            'limit': int(limit),
+            'today_val': today_val,
+            'failed_today': today_val > limit,
+        })
+    return status
+
+
+def rebuild_challenge_progress(username=None, user_range=None, usernames=None):
+    """Recomputes challenge_progress from challenges_log, for one user, a username range,
+    a list of usernames or everyone.
+
+    Streaks are found with the gaps-and-islands trick: within a run of consecutive days,
+    julianday(date) minus the row number is constant. Challenges already claimed stay
+    claimed whatever the log now says, so their points can't be paid twice.
+    """
+    where, params = user_filter(username, user_range, usernames)
+    targets = " UNION ALL ".join("SELECT ?, ?" for _ in CHALLENGES)
+    target_params = tuple(value for cid, challenge in CHALLENGES.items() for value in (cid, challenge["days"]))
+
+    with transaction():
+        run_query('''CREATE TEMP TABLE IF NOT EXISTS claims_kept (
+                         username TEXT, challenge_id TEXT, PRIMARY KEY (username, challenge_id)
+                     ) WITHOUT ROWID''')
+        run_query("DELETE FROM claims_kept")
+        run_query(f"INSERT INTO claims_kept SELECT username, challenge_id FROM challenge_progress {where or 'WHERE 1'} AND claimed = 1",
+                  params)
+        run_query(f"DELETE FROM challenge_progress {where}", params)
+        run_query(f'''WITH targets (challenge_id, days) AS ({targets}),
+                      marked AS (
+                          SELECT username, challenge_id, date,
+                                 julianday(date) - ROW_NUMBER() OVER (PARTITION BY username, challenge_id ORDER BY date) AS run_id
+                          FROM challenges_log {where}
+                      ),
+                      runs AS (
+                          SELECT username, challenge_id, COUNT(*) AS run_length, MAX(date) AS run_end,
+                                 SUM(COUNT(*)) OVER (PARTITION BY username, challenge_id) AS days_completed,
+                                 MAX(MAX(date)) OVER (PARTITION BY username, challenge_id) AS last_date
+                          FROM marked GROUP BY username, challenge_id, run_id
+                      )
+                      INSERT INTO challenge_progress (username, challenge_id, days_completed, streak, last_date, claimed)
+                      SELECT r.username, r.challenge_id, r.days_completed, r.run_length, r.last_date,
+                             COALESCE(r.days_completed >= t.days, 0)
+                      FROM runs r LEFT JOIN targets t ON t.challenge_id = r.challenge_id
+                      WHERE r.run_end = r.last_date''', target_params + params)
+        # A claim, and the points paid for it, stand even if re-logged days now fall short.
+        run_query('''INSERT INTO challenge_progress (username, challenge_id, claimed)
+                     SELECT username, challenge_id, 1 FROM claims_kept WHERE 1
+                     ON CONFLICT (username, challenge_id) DO UPDATE SET claimed = 1''')
+
+
+RECOMPUTE_CHUNK_USERS = 2000
+# Columns of daily_logs holding a metric; any other metric is an app looked up in app_usage.
+LOG_COLUMNS = {'total': 'total_minutes', 'youtube': 'youtube_minutes', 'instagram': 'instagram_minutes'}
+
+
+def _passing_days(first, last):
+    """SQL and params selecting every (username, challenge_id, date) that passes its challenge,
+    for users first..last: one SELECT per challenge over daily_logs, UNION ALL'd."""
+    selects, params = [], []
+    for cid, challenge in CHALLENGES.items():
+        metric = challenge['metric']
+        if metric in LOG_COLUMNS:
+            join, value, join_params = "", f"d.{LOG_COLUMNS[metric]}", []
+        else:
+            join = "LEFT JOIN app_usage a ON a.username = d.username AND a.date = d.date AND a.app = ?"
+            value, join_params = "COALESCE(a.minutes, 0)", [metric]
+        if 'baseline_factor' in challenge:
+            limit, limit_param = "COALESCE(u.baseline_screentime, 300) * ?", challenge['baseline_factor']
+        else:
+            limit, limit_param = "?", challenge['limit']
+        selects.append(f'''SELECT d.username, ?, d.date FROM daily_logs d
+                            JOIN users u ON u.username = d.username {join}
+                            WHERE d.username BETWEEN ? AND ? AND d.total_minutes > 0 AND {value} <= {limit}''')
+        params += [cid, *join_params, first, last, limit_param]
+    return " UNION ALL ".join(selects), tuple(params)
+
+
+def _recompute_range(first, last):
+    """Brings challenges_log and challenge_progress for users first..last in line with daily_logs.
+
+    Returns (days added, days removed, [(username, challenge_id)] newly claimed).
+    """
+    user_range = (first, last)
+    ids = tuple(CHALLENGES)
+    id_list = ", ".join("?" for _ in ids)
+    passing_sql, passing_params = _passing_days(first, last)
+
+    with transaction() as conn:
+        conn.execute('''CREATE TEMP TABLE IF NOT EXISTS challenge_expected (
+                            username TEXT, challenge_id TEXT, date TEXT,
+                            PRIMARY KEY (username, challenge_id, date)
+                        ) WITHOUT ROWID''')
+        conn.execute("DELETE FROM challenge_expected")
+        conn.execute(f"INSERT OR IGNORE INTO challenge_expected {passing_sql}", passing_params)
+
+        added = conn.execute('''INSERT INTO challenges_log
+                                SELECT e.username, e.challenge_id, e.date FROM challenge_expected e
+                                WHERE NOT EXISTS (SELECT 1 FROM challenges_log c
+                                                  WHERE c.username = e.username AND c.challenge_id = e.challenge_id AND c.date = e.date)''').rowcount
+        # Days of challenges no longer in CHALLENGES are history, not errors: only current ids are diffed.
+        removed = conn.execute(f'''DELETE FROM challenges_log
+                                   WHERE username BETWEEN ? AND ? AND challenge_id IN ({id_list})
+                                     AND NOT EXISTS (SELECT 1 FROM challenge_expected e
+                                                     WHERE e.username = challenges_log.username
+                                                       AND e.challenge_id = challenges_log.challenge_id
+                                                       AND e.date = challenges_log.date)''', user_range + ids).rowcount
+
+        claimed_before = set(run_query("SELECT username, challenge_id FROM challenge_progress WHERE username BETWEEN ? AND ? AND claimed = 1",
+                                       user_range, fetch=True))
+        rebuild_challenge_progress(user_range=user_range)
+        claimed_now = run_query("SELECT username, challenge_id FROM challenge_progress WHERE username BETWEEN ? AND ? AND claimed = 1",
+                                user_range, fetch=True)
+        new_claims = [(username, cid) for username, cid in claimed_now if (username, cid) not in claimed_before and cid in CHALLENGES]
+        if new_claims:
+            post_entries([(username, 'challenge', CHALLENGES[cid]["points"], 0.0, cid) for username, cid in new_claims])
+        if added or removed:
+            bump_state_version(name for (name,) in run_query("SELECT username FROM users WHERE username BETWEEN ? AND ?",
+                                                             user_range, fetch=True))
+    return added, removed, new_claims
+
+
+@timed("challenges.recompute")
+def recompute_all_challenges(chunk_users=RECOMPUTE_CHUNK_USERS):
+    """Re-evaluates every challenge for every user from daily_logs, set-based.
+
+    Users are taken chunk_users at a time, in username order, each chunk in one transaction,
+    so the app can keep writing in between. Picks up threshold changes in CHALLENGES and
+    days re-logged with INSERT OR REPLACE; awards challenges that are now complete.
+    """
+    start = time.perf_counter()
+    usernames = [name for (name,) in run_query("SELECT username FROM users ORDER BY username", fetch=True)]
+    report = {'users': len(usernames), 'days_added': 0, 'days_removed': 0, 'claims': 0, 'points': 0}
+    for i in range(0, len(usernames), chunk_users):
+        chunk = usernames[i:i + chunk_users]
+        added, removed, new_claims = _recompute_range(chunk[0], chunk[-1])
+        report['days_added'] += added
+        report['days_removed'] += removed
+        report['claims'] += len(new_claims)
+        report['points'] += sum(CHALLENGES[cid]["points"] for _, cid in new_claims)
+    report['seconds'] = time.perf_counter() - start
+    report['users_per_second'] = len(usernames) / report['seconds'] if report['seconds'] else 0.0
+    return report
@@ -0,0 +1,250 @@
+"""Command-line access to Detoxify's core, without a Streamlit runtime.
+
+    python detox_cli.py ingest alice shots/*.png
+    python detox_cli.py evaluate-challenges alice --all
+    python detox_cli.py forecast alice
+    python detox_cli.py forecast --all
+    python detox_cli.py export daily_logs --user alice -o alice.csv
+    python detox_cli.py export users -o backup/users.parquet
+    python detox_cli.py import backup/users.parquet backup/daily_logs.parquet
+    python detox_cli.py rebuild challenges
+    python detox_cli.py recompute-challenges
+    python detox_cli.py reconcile
+    python detox_cli.py ledger alice
+    python detox_cli.py metrics --serve 9108
+"""
+import argparse
+import json
+import sys
+from datetime import date
+from pathlib import Path
+
+from detox_challenges import CHALLENGES, RECOMPUTE_CHUNK_USERS, rebuild_challenge_progress, recompute_all_challenges
+from detox_core import EXPORT_CHUNK_ROWS, EXPORT_TABLES, challenge_points, evaluate_challenges, get_forecast, ingest_screenshots
+from detox_db import init_db, run_query
+from detox_forecast import BATCH_CHUNK_ROWS, FORECAST_HORIZON, MIN_DAYS_FOR_FORECAST, rebuild_trend_stats, run_batch_forecast
+from detox_leaderboard import rebuild_weekly_stats
+from detox_ledger import get_ledger, reconcile_balances
+from detox_metrics import metrics_snapshot, prometheus_text, serve_metrics
+from detox_transfer import CONFLICT_VERBS, FORMATS, IMPORT_BATCH_ROWS, IMPORT_TABLES, IMPORT_TRANSACTION_ROWS, export_table, file_format, import_tables
+
+
+def _user_exists(username):
+    return bool(run_query("SELECT 1 FROM users WHERE username = ?", (username,), fetch=True))
+
+
+def _report_completed(completed):
+    for cid in completed:
+        print(f"Challenge {cid} ({CHALLENGES[cid]['title']}) completed: +{CHALLENGES[cid]['points']} points")
+    if completed:
+        print(f"+{challenge_points(completed)} points in total")
+
+
+def cmd_ingest(args):
+    files = [(Path(path).name, Path(path).read_bytes()) for path in args.paths]
+    results, completed = ingest_screenshots(args.user, files, args.date and args.date.isoformat(), args.fast)
+    saved = set()
+    for res in results:
+        if 'error' in res:
+            print(f"{res['name']}: OCR error: {res['error']}")
+        elif not res['date']:
+            print(f"{res['name']}: no date found, skipped (pass --date)")
+        else:
+            print(f"{res['name']}: {res['date']} total {res['total']}m, YouTube {res['youtube']}m, Instagram {res['instagram']}m")
+            saved.add(res['date'])
+    print(f"Saved {len(saved)} day(s) for {args.user}")
+    _report_completed(completed)
+    return 0 if saved else 1
+
+
+def cmd_evaluate_challenges(args):
+    _report_completed(evaluate_challenges(args.user, args.date and args.date.isoformat(), args.all))
+    return 0
+
+
+def cmd_forecast(args):
+    if args.all:
+        report = run_batch_forecast(args.chunk_rows)
+        print(f"Forecast {report['users']} users from {report['rows']} log rows in {report['seconds']:.1f}s "
+              f"({report['users_per_second']:.0f} users/s, {report['rows_per_second']:.0f} rows/s)")
+        return 0
+    forecast = get_forecast(args.user)
+    if forecast is None:
+        print(f"Not enough data to forecast {args.user}: log at least {MIN_DAYS_FOR_FORECAST} days first.", file=sys.stderr)
+        return 1
+    for day, minutes in forecast[:args.days]:
+        print(f"{day.isoformat()}\t{minutes}")
+    return 0
+
+
+def _throughput(report):
+    return f"{report['rows']} rows in {report['seconds']:.1f}s ({report['rows_per_second']:.0f} rows/s)"
+
+
+def cmd_export(args):
+    fmt = file_format(args.output or '', args.format)
+    if fmt == 'parquet' and not args.output:
+        print("Parquet needs a file: pass -o", file=sys.stderr)
+        return 1
+    try:
+        report = export_table(args.table, args.output or sys.stdout, fmt, args.user, args.chunk_rows)
+    except ImportError as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"Exported {args.table}: {_throughput(report)}", file=sys.stderr)
+    return 0
+
+
+def cmd_import(args):
+    if args.table and len(args.paths) > 1:
+        print("--table names the table of a single file", file=sys.stderr)
+        return 1
+    sources = []
+    for path in args.paths:
+        table = args.table or Path(path).stem
+        if table not in IMPORT_TABLES:
+            print(f"{path}: can't tell which table it holds; name it after one of {', '.join(IMPORT_TABLES)} or pass --table",
+                  file=sys.stderr)
+            return 1
+        sources.append((table, path))
+    try:
+        report = import_tables(sources, args.on_conflict, args.batch_rows, args.transaction_rows)
+    except (ImportError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 1
+    for table, _ in sources:
+        stats = report[table]
+        print(f"Imported {table}: {_throughput(stats)}, {stats['inserted']} written, {stats['skipped']} skipped")
+    print(f"Derived tables rebuilt in {report['rebuild_seconds']:.1f}s")
+    return 0
+
+
+def cmd_rebuild(args):
+    if args.target in ('challenges', 'all'):
+        rebuild_challenge_progress(args.user)
+        count = run_query("SELECT COUNT(*) FROM challenge_progress", fetch=True)[0][0]
+        print(f"challenge_progress rebuilt ({count} rows)")
+    if args.target in ('trends', 'all'):
+        rebuild_trend_stats(args.user)
+        count = run_query("SELECT COUNT(*) FROM trend_stats", fetch=True)[0][0]
+        print(f"trend_stats rebuilt ({count} users)")
+    if args.target in ('leaderboard', 'all'):
+        rebuild_weekly_stats(args.user)
+        count = run_query("SELECT COUNT(*) FROM weekly_stats", fetch=True)[0][0]
+        print(f"weekly_stats rebuilt ({count} rows)")
+    return 0
+
+
+def cmd_recompute_challenges(args):
+    report = recompute_all_challenges(args.chunk_users)
+    print(f"{report['users']} users: {report['days_added']} passing day(s) added, {report['days_removed']} removed, "
+          f"{report['claims']} challenge(s) completed for +{report['points']} points")
+    print(f"Took {report['seconds']:.1f}s ({report['users_per_second']:.0f} users/s)")
+    return 0
+
+
+def cmd_reconcile(args):
+    drifted = reconcile_balances(args.user)
+    for username, points, ledger_points, balance, ledger_balance in drifted:
+        print(f"{username}: points {points} -> {ledger_points}, balance ₹{balance or 0:.2f} -> ₹{ledger_balance:.2f}")
+    print(f"{len(drifted)} user(s) corrected from the ledger")
+    return 0
+
+
+def cmd_ledger(args):
+    for created, kind, points, rupees, note in get_ledger(args.user, args.limit):
+        print(f"{created}\t{kind}\t{points:+d}\t₹{rupees:+.2f}\t{note or ''}")
+    return 0
+
+
+def cmd_metrics(args):
+    if args.serve:
+        print(f"Serving metrics on http://127.0.0.1:{args.serve}/metrics", file=sys.stderr)
+        serve_metrics(args.serve)
+        return 0
+    text = json.dumps(metrics_snapshot(), indent=2) if args.json else prometheus_text()
+    if args.output:
+        Path(args.output).write_text(text)
+    else:
+        print(text, end='')
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    ingest = commands.add_parser('ingest', help="OCR screenshots and save them as daily logs")
+    ingest.add_argument('user')
+    ingest.add_argument('paths', nargs='+', help="screenshot files")
+    ingest.add_argument('--date', type=date.fromisoformat, help="YYYY-MM-DD for screenshots whose date can't be read")
+    ingest.add_argument('--fast', action='store_true', default=None, help="use the fast OCR mode")
+    ingest.set_defaults(handler=cmd_ingest, needs_user=True)
+
+    evaluate = commands.add_parser('evaluate-challenges', help="run the challenge rules over logged days")
+    evaluate.add_argument('user')
+    when = evaluate.add_mutually_exclusive_group()
+    when.add_argument('--date', type=date.fromisoformat, help="YYYY-MM-DD to evaluate (default: today)")
+    when.add_argument('--all', action='store_true', help="every logged day, oldest first")
+    evaluate.set_defaults(handler=cmd_evaluate_challenges, needs_user=True)
+
+    forecast = commands.add_parser('forecast', help="predict screen time for one user, or every user with --all")
+    forecast.add_argument('user', nargs='?')
+    forecast.add_argument('--days', type=int, default=FORECAST_HORIZON)
+    forecast.add_argument('--all', action='store_true', help="write every user's forecast to the forecasts table")
+    forecast.add_argument('--chunk-rows', type=int, default=BATCH_CHUNK_ROWS, help="daily_logs rows read per chunk with --all")
+    forecast.set_defaults(handler=cmd_forecast, needs_user=False)
+
+    export = commands.add_parser('export', help="stream a table to CSV or Parquet")
+    export.add_argument('table', choices=EXPORT_TABLES)
+    export.add_argument('--user', help="only this user's rows")
+    export.add_argument('-o', '--output', help="file to write (default: stdout)")
+    export.add_argument('--format', choices=FORMATS, help="default: from the file extension, else CSV")
+    export.add_argument('--chunk-rows', type=int, default=EXPORT_CHUNK_ROWS, help="rows read (and Parquet row group size)")
+    export.set_defaults(handler=cmd_export, needs_user=False)
+
+    load = commands.add_parser('import', help="load CSV or Parquet files written by export")
+    load.add_argument('paths', nargs='+', help="files named after their table, e.g. users.csv, daily_logs.parquet")
+    load.add_argument('--table', choices=IMPORT_TABLES, help="the table of a single file with another name")
+    load.add_argument('--on-conflict', choices=tuple(CONFLICT_VERBS), default='skip',
+                      help="skip: keep rows already in the database; replace: the file wins")
+    load.add_argument('--batch-rows', type=int, default=IMPORT_BATCH_ROWS, help="rows per executemany")
+    load.add_argument('--transaction-rows', type=int, default=IMPORT_TRANSACTION_ROWS, help="rows per transaction")
+    load.set_defaults(handler=cmd_import, needs_user=False)
+
+    rebuild = commands.add_parser('rebuild', help="recompute derived tables from the logs")
+    rebuild.add_argument('target', choices=('challenges', 'trends', 'leaderboard', 'all'))
+    rebuild.add_argument('--user', help="only rebuild this user")
+    rebuild.set_defaults(handler=cmd_rebuild, needs_user=False)
+
+    recompute = commands.add_parser('recompute-challenges', help="re-evaluate every user's challenges from the logs, e.g. nightly")
+    recompute.add_argument('--chunk-users', type=int, default=RECOMPUTE_CHUNK_USERS, help="users per transaction")
+    recompute.set_defaults(handler=cmd_recompute_challenges, needs_user=False)
+
+    reconcile = commands.add_parser('reconcile', help="recompute points and wallet balances from the ledger")
+    reconcile.add_argument('--user', help="only this user")
+    reconcile.set_defaults(handler=cmd_reconcile, needs_user=False)
+
+    ledger = commands.add_parser('ledger', help="a user's latest ledger entries, newest first")
+    ledger.add_argument('user')
+    ledger.add_argument('--limit', type=int, default=50)
+    ledger.set_defaults(handler=cmd_ledger, needs_user=True)
+
+    metrics = commands.add_parser('metrics', help="stage timings and counters recorded with DETOX_METRICS=1")
+    metrics.add_argument('--json', action='store_true', help="JSON instead of Prometheus text")
+    metrics.add_argument('-o', '--output', help="write to this file, e.g. for a node_exporter textfile collector")
+    metrics.add_argument('--serve', type=int, metavar='PORT', help="serve Prometheus text over HTTP on localhost")
+    metrics.set_defaults(handler=cmd_metrics, needs_user=False)
+
+    args = parser.parse_args(argv)
+    if args.command == 'forecast' and not (args.user or args.all):
+        parser.error("forecast needs a user or --all")
+
+    init_db()
+    if args.needs_user and not _user_exists(args.user):
+        parser.error(f"no such user: {args.user}")
+    sys.exit(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import hashlib
+import sqlite3
+from datetime import datetime, timedelta
+
+from detox_challenges import CHALLENGES, check_challenges
+from detox_db import bump_state_version, connect, run_query, transaction, user_filter
+from detox_forecast import MIN_DAYS_FOR_FORECAST, forecast_from_stats, get_trend_stats, update_trend_stats
+from detox_leaderboard import clear_user_stats, record_day
+from detox_ledger import post_entry, reset_balances
+from detox_metrics import timed
+from detox_usage import get_day_usage, log_app_times, save_app_usage
+from detox_ocr import parse_ocr_files
+
+
+DEFAULT_BASELINE = 300
+
+
+def make_hashes(password):
+    return hashlib.sha256(str.encode(password)).hexdigest()
+
+def check_hashes(password, hashed_text):
+    if make_hashes(password) == hashed_text:
+        return hashed_text
+    return False
+
+def register_user(username, password, baseline=DEFAULT_BASELINE):
+    try:
+        run_query("INSERT INTO users (username, password, points, balance_inr, baseline_screentime) VALUES (?, ?, ?, ?, ?)",
+                  (username, make_hashes(password), 0, 0.0, baseline))
+        return True
+    except sqlite3.IntegrityError:
+        return False
+
+def login_user(username, password):
+    data = run_query("SELECT * FROM users WHERE username = ?", (username,), fetch=True)
+    if data:
+        if check_hashes(password, data[0][1]):
+            return data[0]
+    return None
+
+
+def get_state_version(username):
+    """Moves whenever anything shown to the user changes; None for an unknown user."""
+    data = run_query("SELECT state_version FROM users WHERE username = ?", (username,), fetch=True)
+    return data[0][0] if data else None
+
+def get_user_stats(username):
+    """(points, balance, baseline, logs_version) for the user."""
+    data = run_query("SELECT points, balance_inr, baseline_screentime, logs_version FROM users WHERE username = ?", (username,), fetch=True)
+    return data[0] if data else (0, 0.0, DEFAULT_BASELINE, 0)
+
+def add_points(username, amount, note=None):
+    return post_entry(username, 'bonus', amount, note=note)
+
+def time_to_str(mins):
+    h, m = divmod(mins, 60)
+    return f"{h}h {m}m"
+
+
+def reset_user_progress(username):
+    """Resets all logs, points, and challenge history for a specific user."""
+    with transaction():
+        run_query("DELETE FROM daily_logs WHERE username = ?", (username,))
+        run_query("UPDATE users SET logs_version = logs_version + 1 WHERE username = ?", (username,))
+        bump_state_version([username])
+        run_query("DELETE FROM app_usage WHERE username = ?", (username,))
+        run_query("DELETE FROM challenges_log WHERE username = ?", (username,))
+        run_query("DELETE FROM challenge_progress WHERE username = ?", (username,))
+        run_query("DELETE FROM trend_stats WHERE username = ?", (username,))
+        run_query("DELETE FROM forecasts WHERE username = ?", (username,))
+        clear_user_stats(username)
+        reset_balances(username)
+
+
+@timed("logs.save")
+def save_daily_logs(username, logs):
+    """Stores one or more days of logs and evaluates their challenges in a single transaction.
+
+    A log may carry 'app_times' ({app: minutes} from OCR); every app in it goes to app_usage.
+    Returns the ids of the challenges completed along the way.
+    """
+    completed = []
+    with transaction():
+        baseline = get_user_stats(username)[2]
+        # Oldest first, so challenge day counts build up in the order the days happened.
+        for log in sorted(logs, key=lambda l: l['date']):
+            previous = run_query("SELECT total_minutes FROM daily_logs WHERE username = ? AND date = ?", (username, log['date']), fetch=True)
+            run_query("INSERT OR REPLACE INTO daily_logs VALUES (?, ?, ?, ?, ?)",
+                      (username, log['date'], log['total'], log['youtube'], log['instagram']))
+            save_app_usage(username, log['date'], log_app_times(log))
+            previous = previous[0][0] if previous else None
+            update_trend_stats(username, log['date'], log['total'], previous)
+            record_day(username, log['date'], log['total'], previous, baseline)
+            completed += check_challenges(username, log, log['date'])
+        run_query("UPDATE users SET logs_version = logs_version + 1 WHERE username = ?", (username,))
+        bump_state_version([username])
+    return completed
+
+
+def challenge_points(completed):
+    return sum(CHALLENGES[cid]['points'] for cid in completed)
+
+
+@timed("logs.ingest")
+def ingest_screenshots(username, files, default_date=None, fast=None):
+    """OCRs (name, bytes) screenshots on the worker pool and saves them as daily logs.
+
+    Each screenshot is dated from its file name or header text, else default_date;
+    ones with no date or an OCR error are left out. When several land on one day the
+    last by name wins. Returns (results sorted by name, completed challenge ids).
+    """
+    results = sorted(parse_ocr_files(files, fast), key=lambda r: r['name'])
+    by_date = {}
+    for res in results:
+        if 'error' in res:
+            continue
+        res['date'] = res['date'] or default_date
+        if res['date']:
+            by_date[res['date']] = {'date': res['date'], 'total': res['total'], 'youtube': res['youtube'],
+                                    'instagram': res['instagram'], 'app_times': res['app_times']}
+    completed = save_daily_logs(username, list(by_date.values())) if by_date else []
+    return results, completed
+
+
+def evaluate_challenges(username, date_str=None, all_days=False):
+    """Runs the challenge rules against days already in daily_logs.
+
+    Checks date_str (today by default), or with all_days every logged day in order. A day
+    already counted for a challenge is skipped, so re-running never awards twice.
+    Returns the ids completed.
+    """
+    if all_days:
+        rows = run_query("SELECT date, total_minutes, youtube_minutes, instagram_minutes FROM daily_logs WHERE username = ? ORDER BY date",
+                         (username,), fetch=True)
+    else:
+        date_str = date_str or datetime.now().strftime("%Y-%m-%d")
+        rows = run_query("SELECT date, total_minutes, youtube_minutes, instagram_minutes FROM daily_logs WHERE username = ? AND date = ?",
+                         (username, date_str), fetch=True)
+    completed = []
+    with transaction():
+        for day, total, youtube, instagram in rows:
+            log = {'total': total, 'youtube': youtube, 'instagram': instagram, 'app_times': get_day_usage(username, day)}
+            completed += check_challenges(username, log, day)
+    return completed
+
+
+# Days of history the Dashboard shows until the user picks a range.
+DEFAULT_HISTORY_DAYS = 90
+# Period start for each rollup grain; weeks start on Monday.
+HISTORY_GRAINS = {
+    'day': "date",
+    'week': "date(date, '-6 days', 'weekday 1')",
+    'month': "strftime('%Y-%m-01', date)",
+}
+
+
+def get_history_rollup(username, grain='day', start=None, end=None):
+    """Logged days between start and end rolled up by day, week or month, in one indexed query.
+
+    Returns [(period start, total, youtube, instagram, days logged)], oldest first. For weeks
+    and months the minutes are averages per logged day, so a half-logged week compares fairly.
+    """
+    period = HISTORY_GRAINS[grain]
+    return run_query(f'''SELECT {period} AS period,
+                              CAST(ROUND(AVG(total_minutes)) AS INTEGER),
+                              CAST(ROUND(AVG(youtube_minutes)) AS INTEGER),
+                              CAST(ROUND(AVG(instagram_minutes)) AS INTEGER),
+                              COUNT(*)
+                       FROM daily_logs WHERE username = ? AND date BETWEEN ? AND ?
+                       GROUP BY period ORDER BY period''',
+                     (username, start or '', end or '9999-12-31'), fetch=True)
+
+
+def get_history_bounds(username):
+    """(first, last) logged date, or (None, None)."""
+    return run_query("SELECT MIN(date), MAX(date) FROM daily_logs WHERE username = ?", (username,), fetch=True)[0]
+
+
+def default_history_range(first_day, last_day):
+    """(start, end) dates the Dashboard opens on: the last DEFAULT_HISTORY_DAYS days up to the latest log."""
+    return max(first_day, last_day - timedelta(days=DEFAULT_HISTORY_DAYS - 1)), last_day
+
+
+def get_forecast(username):
+    """((date, predicted minutes), ...) for the coming week, or None with too little history."""
+    trend = get_trend_stats(username)
+    if trend is None or trend[0] < MIN_DAYS_FOR_FORECAST:
+        return None
+    return forecast_from_stats(*trend)
+
+
+# Every exportable table has a username column. users comes with its password hashes, for moving
+# accounts to another database: keep that export as private as the database file itself.
+EXPORT_TABLES = ('users', 'daily_logs', 'app_usage', 'challenges_log', 'challenge_progress', 'trend_stats', 'forecasts', 'ledger')
+EXPORT_CHUNK_ROWS = 5000
+
+
+def export_chunks(table, username=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Streams a table: yields its column names, then lists of up to chunk_rows rows.
+
+    Reads on a connection of its own, so a large export never sits in memory at once.
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Can't export {table!r}; choose from {', '.join(EXPORT_TABLES)}")
+    where, params = user_filter(username=username)
+    reader = connect()
+    try:
+        cursor = reader.execute(f"SELECT * FROM {table} {where} ORDER BY rowid", params)
+        yield [column[0] for column in cursor.description]
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield rows
+    finally:
+        reader.close()
@@ -0,0 +1,304 @@
+import json
+import os
+import sqlite3
+import threading
+import weakref
+from contextlib import contextmanager
+
+from detox_metrics import timed
+
+
+DB_PATH = os.environ.get("DETOX_DB", "detox_users.db")
+# Connections parked for reuse once the thread that held them ends (Streamlit uses a new thread per rerun).
+POOL_MAX_IDLE = int(os.environ.get("DETOX_DB_POOL_SIZE", 8))
+BUSY_TIMEOUT_MS = int(os.environ.get("DETOX_DB_BUSY_TIMEOUT_MS", 10000))
+# Bumped whenever a table derived from existing data is added; see _migrate.
+SCHEMA_VERSION = 7
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    # WAL + NORMAL only risks the last transactions on power loss, never corruption.
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+)
+
+_local = threading.local()
+_idle = []
+_pool_lock = threading.Lock()
+_schema_lock = threading.Lock()
+_schema_ready = False
+
+
+class _ThreadConnection:
+    __slots__ = ('conn', 'depth', 'bumped', '__weakref__')
+
+
+def _connect():
+    # isolation_level=None: statements autocommit unless wrapped in transaction().
+    conn = sqlite3.connect(DB_PATH, timeout=BUSY_TIMEOUT_MS / 1000, isolation_level=None, check_same_thread=False)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def _release(conn):
+    if conn.in_transaction:
+        conn.execute("ROLLBACK")
+    with _pool_lock:
+        if len(_idle) < POOL_MAX_IDLE:
+            _idle.append(conn)
+            return
+    conn.close()
+
+
+def _thread_state():
+    state = getattr(_local, 'state', None)
+    if state is None:
+        with _pool_lock:
+            conn = _idle.pop() if _idle else None
+        state = _ThreadConnection()
+        state.conn = conn or _connect()
+        state.depth = 0
+        state.bumped = set()
+        # Hand the connection back to the pool when this thread's local storage goes away.
+        weakref.finalize(state, _release, state.conn)
+        _local.state = state
+    return state
+
+
+def connect():
+    """A new connection outside the pool, for long-running readers such as batch jobs."""
+    return _connect()
+
+
+def get_conn():
+    """Returns this thread's open connection to the user database."""
+    return _thread_state().conn
+
+
+@contextmanager
+def transaction():
+    """Runs every query inside the block as one atomic write.
+
+    Nested blocks become savepoints, so an inner failure only undoes the inner block.
+    State versions bumped anywhere inside move once per user, just before the outermost commit.
+    """
+    state = _thread_state()
+    conn = state.conn
+    outermost = state.depth == 0
+    savepoint = f"sp_{state.depth}"
+    # IMMEDIATE takes the write lock up front; a deferred read-then-write
+    # transaction can fail with "database is locked" instead of waiting.
+    conn.execute("BEGIN IMMEDIATE" if outermost else f"SAVEPOINT {savepoint}")
+    state.depth += 1
+    try:
+        yield conn
+        if outermost and state.bumped:
+            conn.executemany("UPDATE users SET state_version = state_version + 1 WHERE username = ?",
+                             [(name,) for name in state.bumped])
+    except BaseException:
+        if outermost:
+            conn.execute("ROLLBACK")
+        else:
+            conn.execute(f"ROLLBACK TO {savepoint}")
+            conn.execute(f"RELEASE {savepoint}")
+        raise
+    else:
+        conn.execute("COMMIT" if outermost else f"RELEASE {savepoint}")
+    finally:
+        if outermost:
+            state.bumped.clear()
+        state.depth -= 1
+
+
+@timed("db.query")
+def run_query(query, params=(), fetch=False):
+    c = get_conn().execute(query, params)
+    if fetch:
+        return c.fetchall()
+
+
+@timed("db.many")
+def run_many(query, rows):
+    get_conn().executemany(query, rows)
+
+
+def user_filter(username=None, user_range=None, usernames=None):
+    """WHERE clause and params for one user, an inclusive (first, last) username range,
+    a list of usernames, or everyone."""
+    if username:
+        return "WHERE username = ?", (username,)
+    if user_range:
+        return "WHERE username BETWEEN ? AND ?", tuple(user_range)
+    if usernames is not None:
+        # One parameter however long the list, so it can't hit SQLite's variable limit.
+        return "WHERE username IN (SELECT value FROM json_each(?))", (json.dumps(list(usernames)),)
+    return "", ()
+
+
+def bump_state_version(usernames):
+    """Marks the users' state as changed, so sessions holding it reload on their next rerun.
+
+    Inside transaction() the bump is deferred to the outermost commit, so a write path that
+    goes through several functions moves each user's version once.
+    """
+    state = _thread_state()
+    if state.depth:
+        state.bumped.update(usernames)
+    else:
+        run_many("UPDATE users SET state_version = state_version + 1 WHERE username = ?", [(name,) for name in usernames])
+
+
+def init_db():
+    """Creates the schema. Runs once per process, later calls return immediately."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if _schema_ready:
+            return
+        with transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS users (
+                            username TEXT PRIMARY KEY,
+                            password TEXT,
+                            points INTEGER,
+                            balance_inr REAL,
+                            baseline_screentime INTEGER,
+                            logs_version INTEGER DEFAULT 0,
+                            state_version INTEGER DEFAULT 0
+                        )''')
+
+            conn.execute('''CREATE TABLE IF NOT EXISTS daily_logs (
+                            username TEXT,
+                            date TEXT,
+                            total_minutes INTEGER,
+                            youtube_minutes INTEGER,
+                            instagram_minutes INTEGER,
+                            PRIMARY KEY (username, date)
+                        )''')
+
+            conn.execute('''CREATE TABLE IF NOT EXISTS challenges_log (
+                            username TEXT,
+                            challenge_id TEXT,
+                            date TEXT,
+                            PRIMARY KEY (username, challenge_id, date)
+                        )''')
+
+            conn.execute('''CREATE TABLE IF NOT EXISTS challenge_progress (
+                            username TEXT,
+                            challenge_id TEXT,
+                            days_completed INTEGER DEFAULT 0,
+                            streak INTEGER DEFAULT 0,
+                            last_date TEXT,
+                            claimed INTEGER DEFAULT 0,
+                            PRIMARY KEY (username, challenge_id)
+                        )''')
+
+            conn.execute('''CREATE TABLE IF NOT EXISTS trend_stats (
+                            username TEXT PRIMARY KEY,
+                            n INTEGER,
+                            sum_x INTEGER,
+                            sum_y INTEGER,
+                            sum_xx INTEGER,
+                            sum_xy INTEGER,
+                            last_x INTEGER,
+                            version INTEGER
+                        )''')
+
+            conn.execute('''CREATE TABLE IF NOT EXISTS forecasts (
+                            username TEXT,
+                            forecast_date TEXT,
+                            predicted_minutes INTEGER,
+                            generated_at TEXT,
+                            PRIMARY KEY (username, forecast_date)
+                        )''')
+
+            conn.execute('''CREATE TABLE IF NOT EXISTS ocr_jobs (
+                            id TEXT PRIMARY KEY,
+                            username TEXT,
+                            name TEXT,
+                            status TEXT,
+                            image BLOB,
+                            fast INTEGER,
+                            result TEXT,
+                            error TEXT,
+                            created REAL,
+                            started REAL,
+                            finished REAL
+                        )''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_jobs_status ON ocr_jobs (status, created)")
+
+            # Append-only: every change to users.points / users.balance_inr, signed.
+            conn.execute('''CREATE TABLE IF NOT EXISTS ledger (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            username TEXT,
+                            created TEXT,
+                            kind TEXT,
+                            points INTEGER DEFAULT 0,
+                            rupees REAL DEFAULT 0.0,
+                            note TEXT
+                        )''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger (username, id)")
+
+            conn.execute('''CREATE TABLE IF NOT EXISTS app_usage (
+                            username TEXT,
+                            date TEXT,
+                            app TEXT,
+                            minutes INTEGER,
+                            PRIMARY KEY (username, date, app)
+                        )''')
+            # Covers per-app series: one range scan over (username, app) in date order, no table lookups.
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_app_usage_app ON app_usage (username, app, date, minutes)")
+
+            # Leaderboard aggregates: one row per user per week (its Monday), plus week = 'all'.
+            conn.execute('''CREATE TABLE IF NOT EXISTS weekly_stats (
+                            username TEXT,
+                            week TEXT,
+                            days_logged INTEGER DEFAULT 0,
+                            total_minutes INTEGER DEFAULT 0,
+                            baseline_minutes INTEGER DEFAULT 0,
+                            points INTEGER DEFAULT 0,
+                            reduction REAL,
+                            PRIMARY KEY (username, week)
+                        )''')
+            # Top-K reads the first entries of a board in order; a rank is a count over the entries above.
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_weekly_points ON weekly_stats (week, points DESC, username)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_weekly_reduction ON weekly_stats (week, reduction DESC, username)")
+            _migrate(conn)
+        _schema_ready = True
+
+
+def _migrate(conn):
+    """Fills tables that summarize older data when an existing database first meets them."""
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < 1:
+        # Imported here: detox_challenges itself imports this module.
+        from detox_challenges import rebuild_challenge_progress
+        rebuild_challenge_progress()
+    if version < 2:
+        from detox_forecast import rebuild_trend_stats
+        rebuild_trend_stats()
+    if version < 3:
+        from detox_ledger import open_ledger_balances
+        open_ledger_balances()
+    if version < 4:
+        from detox_usage import backfill_app_usage
+        backfill_app_usage()
+    if version < 5:
+        # Bumped on every write to the user's daily_logs, so cached history knows when it's stale.
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+        if 'logs_version' not in columns:
+            conn.execute("ALTER TABLE users ADD COLUMN logs_version INTEGER DEFAULT 0")
+    if version < 6:
+        from detox_leaderboard import rebuild_weekly_stats
+        rebuild_weekly_stats()
+    if version < 7:
+        # Bumped on every write to anything the app shows a user; sessions reload their cached state when it moves.
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+        if 'state_version' not in columns:
+            conn.execute("ALTER TABLE users ADD COLUMN state_version INTEGER DEFAULT 0")
+    if version != SCHEMA_VERSION:
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
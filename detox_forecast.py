@@ -0,0 +1,185 @@
+import time
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+from detox_db import connect, init_db, run_many, run_query, transaction, user_filter
+from detox_metrics import timed
+
+
+FORECAST_HORIZON = 7
+# Days are measured from here rather than from year 1, so the running sums of x and x^2
+# stay small enough that n*sum_xx - sum_x^2 doesn't lose precision.
+TREND_ORIGIN = date(2024, 1, 1)
+HISTORY_WINDOW_DAYS = 30
+MIN_DAYS_FOR_FORECAST = 3
+BATCH_CHUNK_ROWS = 100000
+
+
+def _day_number(date_str):
+    return (date.fromisoformat(date_str) - TREND_ORIGIN).days
+
+
+def update_trend_stats(username, date_str, total, previous_total=None):
+    """Folds one logged day into the user's regression sums.
+
+    previous_total is the value the day had before an INSERT OR REPLACE, or None for a new day.
+    """
+    x = _day_number(date_str)
+    new_day = previous_total is None
+    dy = total - (previous_total or 0)
+    run_query('''INSERT INTO trend_stats (username, n, sum_x, sum_y, sum_xx, sum_xy, last_x, version)
+                 VALUES (?, ?, ?, ?, ?, ?, ?, 1)
+                 ON CONFLICT (username) DO UPDATE SET
+                     n = n + excluded.n,
+                     sum_x = sum_x + excluded.sum_x,
+                     sum_y = sum_y + excluded.sum_y,
+                     sum_xx = sum_xx + excluded.sum_xx,
+                     sum_xy = sum_xy + excluded.sum_xy,
+                     last_x = MAX(last_x, excluded.last_x),
+                     version = version + 1''',
+              (username, int(new_day), x if new_day else 0, dy, x * x if new_day else 0, x * dy, x))
+
+
+def get_trend_stats(username):
+    """(n, sum_x, sum_y, sum_xx, sum_xy, last_x) for a user, or None before their first log."""
+    data = run_query("SELECT n, sum_x, sum_y, sum_xx, sum_xy, last_x FROM trend_stats WHERE username = ?", (username,), fetch=True)
+    return data[0] if data else None
+
+
+@lru_cache(maxsize=4096)
+@timed("forecast.fit")
+def forecast_from_stats(n, sum_x, sum_y, sum_xx, sum_xy, last_x):
+    """Least-squares line through the logged days, evaluated for the whole horizon at once.
+
+    Keyed on the sums themselves, so a new or replaced log invalidates it automatically.
+    Returns ((date, predicted minutes), ...) for the FORECAST_HORIZON days after the last log.
+    """
+    import numpy as np
+
+    denom = n * sum_xx - sum_x * sum_x
+    slope = (n * sum_xy - sum_x * sum_y) / denom if denom else 0.0
+    intercept = (sum_y - slope * sum_x) / n
+
+    xs = last_x + np.arange(1, FORECAST_HORIZON + 1)
+    preds = np.maximum(0, np.trunc(intercept + slope * xs)).astype(int)  # prevents -ve min
+    return tuple((TREND_ORIGIN + timedelta(days=int(x)), int(p)) for x, p in zip(xs, preds))
+
+
+def get_recent_totals(username, last_x, days=HISTORY_WINDOW_DAYS):
+    """The last few weeks of logged totals, for plotting next to the forecast."""
+    since = (TREND_ORIGIN + timedelta(days=last_x - days)).isoformat()
+    return run_query("SELECT date, total_minutes FROM daily_logs WHERE username = ? AND date > ? ORDER BY date",
+                     (username, since), fetch=True)
+
+
+def rebuild_trend_stats(username=None, usernames=None):
+    """Recomputes trend_stats from daily_logs, for one user, a list of usernames or everyone."""
+    where, params = user_filter(username, usernames=usernames)
+    with transaction():
+        run_query(f"DELETE FROM trend_stats {where}", params)
+        run_query(f'''INSERT INTO trend_stats (username, n, sum_x, sum_y, sum_xx, sum_xy, last_x, version)
+                      SELECT username, COUNT(*), SUM(x), SUM(y), SUM(x * x), SUM(x * y), MAX(x), 1
+                      FROM (SELECT username,
+                                   CAST(julianday(date) - julianday(?) AS INTEGER) AS x,
+                                   total_minutes AS y
+                            FROM daily_logs {where})
+                      GROUP BY username''', (TREND_ORIGIN.isoformat(),) + params)
+
+
+def fit_trends(codes, x, y, user_count):
+    """Least-squares slope and intercept for many users at once.
+
+    codes[i] says which user row i belongs to (0..user_count-1). Returns
+    (n, slope, intercept, last_x) arrays indexed by user code.
+    """
+    import numpy as np
+
+    n = np.bincount(codes, minlength=user_count)
+    sum_x = np.bincount(codes, x, user_count)
+    sum_y = np.bincount(codes, y, user_count)
+    sum_xx = np.bincount(codes, x * x, user_count)
+    sum_xy = np.bincount(codes, x * y, user_count)
+    last_x = np.full(user_count, np.iinfo(np.int64).min)
+    np.maximum.at(last_x, codes, x.astype(np.int64))
+
+    denom = n * sum_xx - sum_x * sum_x
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = np.where(denom != 0, (n * sum_xy - sum_x * sum_y) / denom, 0.0)
+        intercept = (sum_y - slope * sum_x) / n
+    return n, slope, intercept, last_x
+
+
+def _forecast_chunk(usernames, dates, totals, generated_at):
+    import numpy as np
+
+    names = np.array(usernames)
+    codes = np.concatenate(([0], np.cumsum(names[1:] != names[:-1])))
+    user_names = names[np.concatenate(([True], names[1:] != names[:-1]))]
+    x = (np.array(dates, dtype='datetime64[D]') - np.datetime64(TREND_ORIGIN, 'D')).astype(np.float64)
+    y = np.array(totals, dtype=np.float64)
+
+    n, slope, intercept, last_x = fit_trends(codes, x, y, len(user_names))
+    keep = n >= MIN_DAYS_FOR_FORECAST
+    steps = np.arange(1, FORECAST_HORIZON + 1)
+    future_x = last_x[keep, None] + steps
+    preds = np.maximum(0, np.trunc(intercept[keep, None] + slope[keep, None] * future_x)).astype(int)
+    future_dates = (np.datetime64(TREND_ORIGIN, 'D') + future_x).astype(str)
+
+    rows = zip(np.repeat(user_names[keep], FORECAST_HORIZON).tolist(), future_dates.ravel().tolist(),
+               preds.ravel().tolist(), [generated_at] * preds.size)
+    with transaction():
+        run_many("INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?, ?)", rows)
+    return int(keep.sum())
+
+
+@timed("forecast.batch")
+def run_batch_forecast(chunk_rows=BATCH_CHUNK_ROWS):
+    """Forecasts the next FORECAST_HORIZON days for every user into the forecasts table.
+
+    daily_logs is streamed in primary-key order, chunk_rows at a time, and each chunk's users
+    are fitted together. A user split across chunks is carried into the next one, so memory
+    stays bounded by the chunk size (plus the longest single history).
+    """
+    init_db()
+    generated_at = datetime.now().isoformat(timespec='seconds')
+    start = time.perf_counter()
+    rows_read = users_forecast = 0
+
+    reader = connect()
+    try:
+        cursor = reader.execute("SELECT username, date, total_minutes FROM daily_logs ORDER BY username, date")
+        carry = []
+        while True:
+            batch = cursor.fetchmany(chunk_rows)
+            rows_read += len(batch)
+            pending = carry + batch
+            if not batch:
+                carry = []
+            else:
+                # Hold back the last user: their remaining days may be in the next chunk.
+                last_user = pending[-1][0]
+                cut = len(pending)
+                while cut > 0 and pending[cut - 1][0] == last_user:
+                    cut -= 1
+                if cut == 0:
+                    carry = pending
+                    continue
+                pending, carry = pending[:cut], pending[cut:]
+            if pending:
+                usernames, dates, totals = zip(*pending)
+                users_forecast += _forecast_chunk(usernames, dates, totals, generated_at)
+            if not batch:
+                break
+    finally:
+        reader.close()
+
+    # Only now drop the previous run's rows, so readers never see a half-empty table.
+    run_query("DELETE FROM forecasts WHERE generated_at <> ?", (generated_at,))
+    seconds = time.perf_counter() - start
+    return {
+        'rows': rows_read,
+        'users': users_forecast,
+        'seconds': seconds,
+        'rows_per_second': rows_read / seconds if seconds else 0.0,
+        'users_per_second': users_forecast / seconds if seconds else 0.0,
+    }
@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from detox_db import get_conn, run_many, run_query, transaction
+from detox_metrics import incr, timed
+from detox_ocr import get_ocr_pool, ocr_batches, ocr_screenshots
+
+
+# Jobs waiting or running at once, across all sessions; submit_ocr_jobs refuses more.
+OCR_MAX_QUEUED = int(os.environ.get("DETOX_OCR_MAX_QUEUED", 32))
+JOB_RETENTION_SECONDS = 24 * 3600
+
+_resume_lock = threading.Lock()
+_resumed = False
+
+
+@timed("jobs.run")
+def _run_jobs(job_ids):
+    """Worker-process side: claims queued jobs, OCRs their screenshots as one batch and stores the results."""
+    now = time.time()
+    claimed = [job_id for job_id in job_ids
+               if get_conn().execute("UPDATE ocr_jobs SET status = 'running', started = ? WHERE id = ? AND status = 'queued'",
+                                     (now, job_id)).rowcount == 1]
+    if not claimed:
+        return
+    placeholders = ", ".join("?" for _ in claimed)
+    jobs = run_query(f"SELECT id, name, image, fast FROM ocr_jobs WHERE id IN ({placeholders})", tuple(claimed), fetch=True)
+    # Jobs are batched per upload, so they share a mode.
+    fast = jobs[0][3]
+    try:
+        results = ocr_screenshots([(name, image) for _, name, image, _ in jobs], None if fast is None else bool(fast))
+    except Exception as e:
+        run_many("UPDATE ocr_jobs SET status = 'failed', error = ?, image = NULL, finished = ? WHERE id = ?",
+                 [(str(e), time.time(), job_id) for job_id, _, _, _ in jobs])
+        return
+    finished = time.time()
+    run_many("UPDATE ocr_jobs SET status = ?, result = ?, error = ?, image = NULL, finished = ? WHERE id = ?",
+             [('failed', None, result['error'], finished, job_id) if 'error' in result else
+              ('done', json.dumps(result), None, finished, job_id)
+              for (job_id, _, _, _), result in zip(jobs, results)])
+
+
+def _mark_failed(job_ids, error):
+    run_many("UPDATE ocr_jobs SET status = 'failed', error = ?, finished = ? WHERE id = ? AND status IN ('queued', 'running')",
+             [(str(error), time.time(), job_id) for job_id in job_ids])
+
+
+def _dispatch(job_ids):
+    try:
+        future = get_ocr_pool().submit(_run_jobs, job_ids)
+    except Exception as e:
+        # Left 'queued', the jobs would wait forever and keep counting against OCR_MAX_QUEUED.
+        _mark_failed(job_ids, e)
+        return
+
+    def mark_failed(done):
+        # OCR errors are recorded by the worker itself; this catches a crashed or broken pool.
+        if done.exception() is not None:
+            _mark_failed(job_ids, done.exception())
+    future.add_done_callback(mark_failed)
+
+
+def submit_ocr_jobs(username, files, fast=None):
+    """Queues (name, bytes) screenshots for OCR, a batch per worker task.
+
+    Returns a job id per file, or None for files that didn't fit in the queue.
+    """
+    # One write transaction, so concurrent sessions can't both see the same free room.
+    with transaction():
+        depth = run_query("SELECT COUNT(*) FROM ocr_jobs WHERE status IN ('queued', 'running')", fetch=True)[0][0]
+        room = max(0, OCR_MAX_QUEUED - depth)
+        created = time.time()
+        jobs = [(uuid.uuid4().hex, username, name, data, None if fast is None else int(fast), created)
+                for name, data in files[:room]]
+        run_many("INSERT INTO ocr_jobs (id, username, name, status, image, fast, created) VALUES (?, ?, ?, 'queued', ?, ?, ?)", jobs)
+    if len(files) > room:
+        incr("jobs.rejected", len(files) - room)
+    # Dispatched only once committed: the workers read the jobs through their own connections.
+    job_ids = [job[0] for job in jobs]
+    for batch in ocr_batches(job_ids):
+        _dispatch(batch)
+    return job_ids + [None] * (len(files) - len(job_ids))
+
+
+def get_ocr_jobs(job_ids):
+    """Status of several jobs in one query: {id: {'status', 'name', 'result', 'error'}}."""
+    if not job_ids:
+        return {}
+    placeholders = ", ".join("?" for _ in job_ids)
+    rows = run_query(f"SELECT id, name, status, result, error FROM ocr_jobs WHERE id IN ({placeholders})", tuple(job_ids), fetch=True)
+    return {job_id: {'name': name, 'status': status, 'result': json.loads(result) if result else None, 'error': error}
+            for job_id, name, status, result, error in rows}
+
+
+def resume_ocr_jobs():
+    """Re-dispatches jobs left behind by a restarted process and drops old finished ones.
+
+    Runs once per process; later calls return immediately.
+    """
+    global _resumed
+    if _resumed:
+        return
+    with _resume_lock:
+        if _resumed:
+            return
+        run_query("DELETE FROM ocr_jobs WHERE status IN ('done', 'failed') AND finished < ?", (time.time() - JOB_RETENTION_SECONDS,))
+        # Assumes one app process per database: the worker pool belongs to this process and it just started.
+        run_query("UPDATE ocr_jobs SET status = 'queued', started = NULL WHERE status = 'running'")
+        queued = run_query("SELECT id, fast FROM ocr_jobs WHERE status = 'queued' ORDER BY created", fetch=True)
+        for fast in {fast for _, fast in queued}:
+            for batch in ocr_batches([job_id for job_id, job_fast in queued if job_fast == fast]):
+                _dispatch(batch)
+        _resumed = True
@@ -0,0 +1,130 @@
+from datetime import date, datetime, timedelta
+
+from detox_db import run_many, run_query, transaction, user_filter
+
+
+# weekly_stats holds one row per user per week (keyed by the week's Monday) plus one per user
+# with week = 'all', kept current as days are logged and points awarded, so the boards read
+# a few index entries instead of scanning users and daily_logs.
+ALL_TIME = 'all'
+# Ledger kinds that count as points earned. Spending them (redeem) doesn't lower a rank.
+EARNING_KINDS = ('challenge', 'bonus')
+# Balances brought in from before the ledger or from an import: all-time points only.
+CARRIED_KINDS = ('opening', 'import')
+BOARDS = {
+    'points': "points",
+    # Share of the baseline not used on the days logged; negative when over it.
+    'reduction': "reduction",
+}
+_REDUCTION = "1.0 - total_minutes * 1.0 / NULLIF(baseline_minutes, 0)"
+
+
+def week_of(day):
+    """The Monday (YYYY-MM-DD) of the week a date falls in, as in HISTORY_GRAINS."""
+    if isinstance(day, str):
+        day = datetime.strptime(day, "%Y-%m-%d").date()
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+def current_week():
+    return week_of(date.today())
+
+
+def _upsert(rows):
+    """Adds (username, week, days, minutes, baseline minutes, points) deltas to weekly_stats."""
+    run_many('''INSERT INTO weekly_stats (username, week, days_logged, total_minutes, baseline_minutes, points, reduction)
+                 VALUES (?, ?, ?, ?, ?, ?, NULL)
+                 ON CONFLICT (username, week) DO UPDATE SET
+                     days_logged = days_logged + excluded.days_logged,
+                     total_minutes = total_minutes + excluded.total_minutes,
+                     baseline_minutes = baseline_minutes + excluded.baseline_minutes,
+                     points = points + excluded.points''', rows)
+
+
+def _refresh_reduction(keys):
+    run_many(f"UPDATE weekly_stats SET reduction = {_REDUCTION} WHERE username = ? AND week = ?", keys)
+
+
+def record_day(username, date_str, total, previous_total, baseline):
+    """Counts one saved day of logs; previous_total is the day's old total if it was re-logged."""
+    if previous_total is None:
+        days, minutes, baseline_minutes = 1, total, baseline
+    else:
+        days, minutes, baseline_minutes = 0, total - previous_total, 0
+    keys = [(username, week_of(date_str)), (username, ALL_TIME)]
+    with transaction():
+        _upsert([(name, week, days, minutes, baseline_minutes, 0) for name, week in keys])
+        _refresh_reduction(keys)
+
+
+def record_points(awards):
+    """Counts (username, kind, points) ledger entries towards this week's and all-time points."""
+    week = current_week()
+    rows = [(username, period, 0, 0, 0, points) for username, kind, points in awards
+            if kind in EARNING_KINDS and points > 0 for period in (week, ALL_TIME)]
+    if rows:
+        _upsert(rows)
+
+
+def get_leaderboard(board='points', week=ALL_TIME, limit=10):
+    """The top of a board: [(rank, username, value, days logged)], best first.
+
+    Tied users share a rank. The reduction board only has users who logged a day that week.
+    """
+    column = BOARDS[board]
+    rows = run_query(f'''SELECT username, {column}, days_logged FROM weekly_stats
+                         WHERE week = ? AND {column} IS NOT NULL
+                         ORDER BY {column} DESC, username LIMIT ?''', (week, limit), fetch=True)
+    ranked = []
+    for i, (username, value, days) in enumerate(rows):
+        rank = ranked[-1][0] if ranked and ranked[-1][2] == value else i + 1
+        ranked.append((rank, username, value, days))
+    return ranked
+
+
+def get_my_rank(username, board='points', week=ALL_TIME):
+    """(rank, value, users ranked) for one user on a board, or None if they aren't on it."""
+    column = BOARDS[board]
+    row = run_query(f"SELECT {column} FROM weekly_stats WHERE username = ? AND week = ?", (username, week), fetch=True)
+    if not row or row[0][0] is None:
+        return None
+    value = row[0][0]
+    # Both counts are range scans over the (week, value) index.
+    above = run_query(f"SELECT COUNT(*) FROM weekly_stats WHERE week = ? AND {column} > ?", (week, value), fetch=True)[0][0]
+    ranked = run_query(f"SELECT COUNT(*) FROM weekly_stats WHERE week = ? AND {column} IS NOT NULL", (week,), fetch=True)[0][0]
+    return above + 1, value, ranked
+
+
+def clear_user_stats(username):
+    run_query("DELETE FROM weekly_stats WHERE username = ?", (username,))
+
+
+def rebuild_weekly_stats(username=None, usernames=None):
+    """Recomputes weekly_stats from daily_logs and the ledger, for one user, a list of usernames or everyone.
+
+    Points are bucketed by the week they were booked; all-time points also include
+    balances carried over from before the ledger or from an import. Entries before a user's
+    last reset don't count, as the reset cleared their rows.
+    """
+    where, params = user_filter(username, usernames=usernames)
+    kinds = ", ".join("?" for _ in EARNING_KINDS)
+    all_kinds = ", ".join("?" for _ in EARNING_KINDS + CARRIED_KINDS)
+    since_reset = ("id > COALESCE((SELECT MAX(id) FROM ledger r WHERE r.username = ledger.username AND r.kind = 'reset'), 0)"
+                   + where.replace("WHERE", " AND", 1))
+    with transaction():
+        run_query(f"DELETE FROM weekly_stats {where}", params)
+        for period in ("date(d.date, '-6 days', 'weekday 1')", f"'{ALL_TIME}'"):
+            run_query(f'''INSERT INTO weekly_stats (username, week, days_logged, total_minutes, baseline_minutes, points)
+                          SELECT d.username, {period}, COUNT(*), SUM(d.total_minutes),
+                                 COUNT(*) * COALESCE(u.baseline_screentime, 300), 0
+                          FROM daily_logs d JOIN users u ON u.username = d.username
+                          {where.replace("username", "d.username")}
+                          GROUP BY d.username, {period}''', params)
+        earned = run_query(f'''SELECT username, date(created, '-6 days', 'weekday 1'), SUM(points) FROM ledger
+                               WHERE kind IN ({kinds}) AND points > 0 AND {since_reset}
+                               GROUP BY username, 2''', EARNING_KINDS + params, fetch=True)
+        all_time = run_query(f'''SELECT username, ?, SUM(points) FROM ledger
+                                 WHERE kind IN ({all_kinds}) AND points > 0 AND {since_reset}
+                                 GROUP BY username''', (ALL_TIME,) + EARNING_KINDS + CARRIED_KINDS + params, fetch=True)
+        _upsert([(name, week, 0, 0, 0, points) for name, week, points in earned + all_time])
+        run_query(f"UPDATE weekly_stats SET reduction = {_REDUCTION} {where}", params)
@@ -0,0 +1,119 @@
+from collections import defaultdict
+from datetime import datetime
+
+from detox_db import bump_state_version, get_conn, run_many, run_query, transaction, user_filter
+from detox_leaderboard import record_points
+
+
+# users.points / users.balance_inr are running totals of this user's ledger rows. Only the
+# functions here change them, always in the same transaction as the rows they add (and the
+# points earned on the leaderboard's weekly_stats).
+
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+
+def post_entry(username, kind, points=0, rupees=0.0, note=None):
+    """Books one change to a user's points and wallet, unless it would take either below zero.
+
+    The check and the update are a single UPDATE, so concurrent sessions can't both
+    spend the same points. Returns True if the entry was booked.
+    """
+    with transaction():
+        booked = get_conn().execute('''UPDATE users SET points = points + ?, balance_inr = ROUND(balance_inr + ?, 2)
+                                       WHERE username = ? AND points + ? >= 0 AND ROUND(balance_inr + ?, 2) >= 0''',
+                                    (points, rupees, username, points, rupees)).rowcount == 1
+        if booked:
+            run_query("INSERT INTO ledger (username, created, kind, points, rupees, note) VALUES (?, ?, ?, ?, ?, ?)",
+                      (username, _now(), kind, points, rupees, note))
+            record_points([(username, kind, points)])
+            bump_state_version([username])
+    return booked
+
+
+def post_entries(entries):
+    """Books many (username, kind, points, rupees, note) credits in one transaction.
+
+    No balance checks: meant for awards. Each user's total moves with one UPDATE.
+    """
+    created = _now()
+    totals = defaultdict(lambda: [0, 0.0])
+    for username, _, points, rupees, _ in entries:
+        totals[username][0] += points
+        totals[username][1] += rupees
+    with transaction():
+        run_many("INSERT INTO ledger (username, created, kind, points, rupees, note) VALUES (?, ?, ?, ?, ?, ?)",
+                 [(username, created, kind, points, rupees, note) for username, kind, points, rupees, note in entries])
+        run_many("UPDATE users SET points = points + ?, balance_inr = ROUND(balance_inr + ?, 2) WHERE username = ?",
+                 [(points, rupees, username) for username, (points, rupees) in totals.items()])
+        record_points([(username, kind, points) for username, kind, points, _, _ in entries])
+        bump_state_version(totals)
+
+
+def redeem_points(username, points, rupees):
+    """Turns points into wallet money. False if the user doesn't have the points."""
+    return post_entry(username, 'redeem', -points, float(rupees), f"{points} pts for ₹{rupees}")
+
+
+def withdraw_funds(username, rupees, method):
+    """Takes money out of the wallet. False if the balance doesn't cover it."""
+    return post_entry(username, 'withdraw', 0, -float(rupees), method)
+
+
+def reset_balances(username):
+    """Books the entry that brings a user's points and wallet back to zero."""
+    with transaction():
+        row = run_query("SELECT points, balance_inr FROM users WHERE username = ?", (username,), fetch=True)
+        if row and (row[0][0] or row[0][1]):
+            post_entry(username, 'reset', -row[0][0], -row[0][1])
+
+
+def get_ledger(username, limit=50):
+    """The user's latest entries, newest first: (created, kind, points, rupees, note)."""
+    return run_query("SELECT created, kind, points, rupees, note FROM ledger WHERE username = ? ORDER BY id DESC LIMIT ?",
+                     (username, limit), fetch=True)
+
+
+def open_ledger_balances():
+    """Gives every user with points or money but no ledger rows an 'opening' entry for it.
+
+    Runs when an existing database first gets the ledger, so the totals reconcile.
+    """
+    run_query('''INSERT INTO ledger (username, created, kind, points, rupees, note)
+                 SELECT username, ?, 'opening', COALESCE(points, 0), COALESCE(balance_inr, 0.0), NULL FROM users u
+                 WHERE (points <> 0 OR balance_inr <> 0)
+                   AND NOT EXISTS (SELECT 1 FROM ledger l WHERE l.username = u.username)''', (_now(),))
+
+
+def book_imported_balances(usernames):
+    """Books an 'import' entry for each of the users whose points or wallet differ
+    from their ledger, so totals brought in by an import reconcile.
+    """
+    where, params = user_filter(usernames=usernames)
+    run_query(f'''INSERT INTO ledger (username, created, kind, points, rupees, note)
+                  SELECT u.username, ?, 'import', COALESCE(u.points, 0) - COALESCE(l.points, 0),
+                         ROUND(COALESCE(u.balance_inr, 0.0) - COALESCE(l.rupees, 0.0), 2), NULL
+                  FROM users u LEFT JOIN (SELECT username, SUM(points) AS points, SUM(rupees) AS rupees FROM ledger
+                                          {where} GROUP BY username) l ON l.username = u.username
+                  {where.replace("username", "u.username", 1)}
+                    AND (COALESCE(u.points, 0) <> COALESCE(l.points, 0)
+                         OR ABS(COALESCE(u.balance_inr, 0.0) - COALESCE(l.rupees, 0.0)) >= 0.005)''', (_now(),) + params + params)
+
+
+def reconcile_balances(username=None):
+    """Recomputes users.points and users.balance_inr from the ledger in one pass.
+
+    Returns [(username, cached points, ledger points, cached balance, ledger balance)]
+    for each user whose running totals had drifted; those totals are then corrected.
+    """
+    where, params = user_filter(username)
+    with transaction():
+        drifted = run_query(f'''SELECT u.username, u.points, COALESCE(l.points, 0), u.balance_inr, COALESCE(l.rupees, 0.0)
+                                FROM users u LEFT JOIN (SELECT username, SUM(points) AS points, ROUND(SUM(rupees), 2) AS rupees
+                                                        FROM ledger GROUP BY username) l ON l.username = u.username
+                                {where.replace("username", "u.username", 1)}''', params, fetch=True)
+        drifted = [row for row in drifted if row[1] != row[2] or abs((row[3] or 0.0) - row[4]) >= 0.005]
+        run_many("UPDATE users SET points = ?, balance_inr = ? WHERE username = ?",
+                 [(ledger_points, ledger_rupees, name) for name, _, ledger_points, _, ledger_rupees in drifted])
+    return drifted
@@ -0,0 +1,224 @@
+import atexit
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+
+# Off by default. Read once at import: when off, @timed hands back the undecorated function
+# and timer() a shared no-op context, so instrumented code costs next to nothing.
+METRICS_ENABLED = os.environ.get("DETOX_METRICS", "0") == "1"
+METRICS_DB_PATH = os.environ.get("DETOX_METRICS_DB", "detox_metrics.db")
+# Each process writes its numbers to the metrics table at most this often (OCR workers
+# are separate processes, so the table is where everything meets).
+METRICS_FLUSH_SECONDS = float(os.environ.get("DETOX_METRICS_FLUSH_SECONDS", 10))
+RESERVOIR_SIZE = 1024
+RETENTION_SECONDS = 7 * 24 * 3600
+QUANTILES = (0.5, 0.95)
+
+_PROCESS_ID = uuid.uuid4().hex
+_lock = threading.Lock()
+_stages = {}
+_dirty = set()
+_last_flush = time.monotonic()
+_conn = None
+_NULL = nullcontext()
+
+
+class _Stage:
+    __slots__ = ('count', 'total', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.samples = []
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        # Reservoir sampling: a uniform sample of every call so far, in bounded memory.
+        if len(self.samples) < RESERVOIR_SIZE:
+            self.samples.append(seconds)
+        else:
+            slot = random.randrange(self.count)
+            if slot < RESERVOIR_SIZE:
+                self.samples[slot] = seconds
+
+
+def _metrics_conn():
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(METRICS_DB_PATH, timeout=10, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute('''CREATE TABLE IF NOT EXISTS metrics (
+                            stage TEXT,
+                            process TEXT,
+                            count INTEGER,
+                            total_seconds REAL,
+                            samples TEXT,
+                            updated REAL,
+                            PRIMARY KEY (stage, process)
+                        )''')
+    return _conn
+
+
+def _flush_locked():
+    global _last_flush
+    _last_flush = time.monotonic()
+    if not _dirty:
+        return
+    now = time.time()
+    rows = [(name, _PROCESS_ID, _stages[name].count, _stages[name].total, json.dumps(_stages[name].samples), now)
+            for name in _dirty]
+    _dirty.clear()
+    conn = _metrics_conn()
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO metrics VALUES (?, ?, ?, ?, ?, ?)", rows)
+        conn.execute("DELETE FROM metrics WHERE updated < ?", (now - RETENTION_SECONDS,))
+
+
+def _record(name, seconds=None, amount=1):
+    with _lock:
+        stage = _stages.get(name)
+        if stage is None:
+            stage = _stages[name] = _Stage()
+        if seconds is None:
+            stage.count += amount
+        else:
+            stage.add(seconds)
+        _dirty.add(name)
+        if time.monotonic() - _last_flush >= METRICS_FLUSH_SECONDS:
+            try:
+                _flush_locked()
+            except sqlite3.Error:
+                pass  # metrics must never break the app; the numbers go out with the next flush
+
+
+def flush_metrics():
+    """Writes this process's numbers to the metrics table now rather than at the next interval."""
+    if METRICS_ENABLED:
+        with _lock:
+            _flush_locked()
+
+
+if METRICS_ENABLED:
+    # Pool workers end without running atexit, so theirs go out on the flush interval instead.
+    atexit.register(flush_metrics)
+
+
+def record(name, seconds):
+    """Records one timing measured by the caller."""
+    if METRICS_ENABLED:
+        _record(name, seconds)
+
+
+@contextmanager
+def _timing(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - start)
+
+
+def timer(name):
+    """Context manager that records how long its block takes under name."""
+    return _timing(name) if METRICS_ENABLED else _NULL
+
+
+def timed(name):
+    """Decorator form of timer()."""
+    def decorate(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def incr(name, amount=1):
+    """Counts an event that has no duration, such as a cache hit."""
+    if METRICS_ENABLED:
+        _record(name, amount=amount)
+
+
+def metrics_snapshot():
+    """Every process's numbers merged: {stage: {'count', 'total_seconds', 'p50', 'p95'}}.
+
+    Percentiles come from the pooled reservoir samples; counters have no samples and no percentiles.
+    """
+    flush_metrics()
+    if not os.path.exists(METRICS_DB_PATH):
+        return {}
+    conn = sqlite3.connect(METRICS_DB_PATH, timeout=10)
+    try:
+        rows = conn.execute("SELECT stage, count, total_seconds, samples FROM metrics").fetchall()
+    except sqlite3.OperationalError:
+        rows = []
+    finally:
+        conn.close()
+
+    merged = {}
+    for name, count, total, samples in rows:
+        stage = merged.setdefault(name, {'count': 0, 'total_seconds': 0.0, 'samples': []})
+        stage['count'] += count
+        stage['total_seconds'] += total
+        stage['samples'] += json.loads(samples)
+    for stage in merged.values():
+        samples = sorted(stage.pop('samples'))
+        for q in QUANTILES:
+            stage[f"p{int(q * 100)}"] = samples[min(len(samples) - 1, int(q * len(samples)))] if samples else None
+    return merged
+
+
+def prometheus_text(snapshot=None):
+    """The snapshot in Prometheus text exposition format."""
+    snapshot = metrics_snapshot() if snapshot is None else snapshot
+    lines = ["# TYPE detox_stage_seconds summary"]
+    counters = []
+    for name in sorted(snapshot):
+        stage = snapshot[name]
+        if stage['p50'] is None:
+            counters.append(f'detox_events_total{{name="{name}"}} {stage["count"]}')
+            continue
+        for q in QUANTILES:
+            lines.append(f'detox_stage_seconds{{stage="{name}",quantile="{q}"}} {stage[f"p{int(q * 100)}"]:.6f}')
+        lines.append(f'detox_stage_seconds_sum{{stage="{name}"}} {stage["total_seconds"]:.6f}')
+        lines.append(f'detox_stage_seconds_count{{stage="{name}"}} {stage["count"]}')
+    if counters:
+        lines += ["# TYPE detox_events_total counter"] + counters
+    return "\n".join(lines) + "\n"
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serves prometheus_text() at http://host:port/metrics until interrupted."""
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') not in ('', '/metrics'):
+                self.send_error(404)
+                return
+            body = prometheus_text().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    HTTPServer((host, port), Handler).serve_forever()
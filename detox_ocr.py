@@ -0,0 +1,542 @@
+import calendar
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import re
+import sqlite3
+import string
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, timedelta
+
+from PIL import Image
+
+from detox_metrics import incr, timed, timer
+
+
+OCR_LANGUAGES = ['en']
+OCR_USE_GPU = os.environ.get("DETOX_OCR_GPU", "0") == "1"
+# "1" starts the OCR workers (each loading its reader) as soon as the app starts, "0" waits for the first upload.
+OCR_PRELOAD = os.environ.get("DETOX_OCR_PRELOAD", "1") == "1"
+# Each worker process holds its own reader, so this bounds memory as well as parallelism.
+OCR_WORKERS = int(os.environ.get("DETOX_OCR_WORKERS", min(4, os.cpu_count() or 1)))
+
+# Set DETOX_OCR_CACHE to an empty string to turn the result cache off.
+OCR_CACHE_PATH = os.environ.get("DETOX_OCR_CACHE", "ocr_cache.db")
+OCR_CACHE_MAX_ENTRIES = int(os.environ.get("DETOX_OCR_CACHE_MAX_ENTRIES", 5000))
+OCR_CACHE_MAX_AGE_DAYS = float(os.environ.get("DETOX_OCR_CACHE_MAX_AGE_DAYS", 90))
+# Max differing bits (out of 256) for a perceptual-hash match. Screenshots from different
+# days share a layout, so keep this small; 0 disables near-duplicate matching.
+OCR_CACHE_NEAR_DISTANCE = int(os.environ.get("DETOX_OCR_CACHE_NEAR_DISTANCE", 0))
+OCR_CACHE_VERSION = 3
+
+# Fast mode shrinks what EasyOCR has to read: the app list only, grayscale, at a lower
+# resolution, with recognition limited to characters that occur in app names and durations.
+OCR_FAST_MODE = os.environ.get("DETOX_OCR_FAST", "0") == "1"
+OCR_FAST_TARGET_HEIGHT = int(os.environ.get("DETOX_OCR_FAST_HEIGHT", 1280))
+# (left, top, right, bottom) as fractions of the screenshot. The default skips the header and
+# usage chart, which also hides the date header, so dates then come from file names only.
+OCR_FAST_CROP = tuple(float(v) for v in os.environ.get("DETOX_OCR_FAST_CROP", "0,0.25,1,1").split(","))
+OCR_FAST_ALLOWLIST = string.ascii_letters + string.digits + " .,:'&+-"
+
+# Above 1, several screenshots are OCR'd in one readtext_batched call, which needs every image in
+# the batch the same size: each is scaled to a common width (at most this) and padded to the tallest.
+# Off by default: measure it with bench_ocr.py --batch-sizes on your hardware before turning it on.
+OCR_BATCH_SIZE = int(os.environ.get("DETOX_OCR_BATCH_SIZE", 1))
+OCR_BATCH_WIDTH = int(os.environ.get("DETOX_OCR_BATCH_WIDTH", 1080))
+# Text crops the recognizer reads per forward pass.
+RECOGNITION_BATCH_SIZE = 16
+
+TIME_PATTERN = re.compile(r'(?:(\d+)\s*[hH]\s*)?(?:(\d+)\s*[mM])?')
+FILENAME_DATE_PATTERN = re.compile(r'(20\d{2})[-_.]?(0[1-9]|1[0-2])[-_.]?(0[1-9]|[12]\d|3[01])')
+TEXT_DATE_PATTERN = re.compile(r'\b(?:(\d{1,2})\s+([A-Za-z]{3,9})|([A-Za-z]{3,9})\s+(\d{1,2}))\b')
+MONTHS = {name.lower(): i for i, name in enumerate(calendar.month_name) if name}
+
+_reader = None
+_reader_lock = threading.Lock()
+_readtext_lock = threading.Lock()
+_engine_info = {'loaded': False}
+_pool = None
+_pool_lock = threading.Lock()
+_worker_info = []
+_cache_local = threading.local()
+
+
+def _rss_mb():
+    """Resident memory of this process in MB, or None if the platform can't tell us."""
+    try:
+        with open('/proc/self/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def get_ocr_reader():
+    """Returns the process-wide EasyOCR reader, building it on first use."""
+    global _reader
+    if _reader is None:
+        with _reader_lock:
+            if _reader is None:
+                rss_before = _rss_mb()
+                start = time.perf_counter()
+                # Imported here, not at the top: easyocr pulls in torch, which costs seconds and
+                # hundreds of MB, and only the Log Data page ever needs it.
+                with timer("ocr.reader_load"):
+                    import easyocr
+                    reader = easyocr.Reader(OCR_LANGUAGES, gpu=OCR_USE_GPU)
+                load_seconds = time.perf_counter() - start
+                rss_after = _rss_mb()
+
+                _engine_info.update({
+                    'loaded': True,
+                    'load_seconds': load_seconds,
+                    'rss_mb': rss_after,
+                    'footprint_mb': (rss_after - rss_before) if rss_before is not None and rss_after is not None else None,
+                    'gpu': OCR_USE_GPU,
+                    'pid': os.getpid(),
+                })
+                _reader = reader
+    return _reader
+
+
+def ocr_engine_info():
+    """Load time and memory footprint of this process's reader, for sizing workers."""
+    return dict(_engine_info)
+
+
+def warm_up_ocr():
+    """Starts the OCR worker pool when preloading is enabled, so every worker loads its reader now.
+
+    Returns immediately; safe to call on every Streamlit rerun, only the first call does anything.
+    """
+    if not OCR_PRELOAD or _worker_info:
+        return
+    pool = get_ocr_pool()
+    with _pool_lock:
+        if not _worker_info:
+            # The pool starts a process per task while none is idle, and each runs the reader-loading
+            # initializer before its task, so this brings up every worker and reports back from each.
+            _worker_info.extend(pool.submit(ocr_engine_info) for _ in range(OCR_WORKERS))
+
+
+def ocr_worker_info():
+    """ocr_engine_info() from each worker that has finished loading so far."""
+    infos = {}
+    for future in _worker_info:
+        if future.done() and future.exception() is None:
+            info = future.result()
+            infos[info['pid']] = info
+    return list(infos.values())
+
+
+def image_hash(image):
+    """SHA-256 of the decoded pixels, so re-encoded copies of a screenshot still match."""
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def perceptual_hash(image, size=16):
+    """256-bit difference hash as hex; visually near-identical images differ in a few bits."""
+    small = image.convert('L').resize((size + 1, size), Image.BILINEAR)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{size * size // 4}x}"
+
+
+def _cache_conn():
+    conn = getattr(_cache_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(OCR_CACHE_PATH, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        if conn.execute("PRAGMA user_version").fetchone()[0] != OCR_CACHE_VERSION:
+            # It's only a cache: on a layout change start over rather than migrate.
+            conn.execute("DROP TABLE IF EXISTS ocr_cache")
+            conn.execute("DROP TABLE IF EXISTS ocr_cache_stats")
+            conn.execute(f"PRAGMA user_version = {OCR_CACHE_VERSION}")
+        conn.execute('''CREATE TABLE IF NOT EXISTS ocr_cache (
+                        image_hash TEXT,
+                        variant TEXT,
+                        phash TEXT,
+                        texts TEXT,
+                        created REAL,
+                        last_used REAL,
+                        hits INTEGER DEFAULT 0,
+                        PRIMARY KEY (image_hash, variant)
+                    )''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ocr_cache_last_used ON ocr_cache (last_used)")
+        conn.execute("CREATE TABLE IF NOT EXISTS ocr_cache_stats (name TEXT PRIMARY KEY, value INTEGER)")
+        _cache_local.conn = conn
+    return conn
+
+
+def _bump_cache_stat(conn, name, amount=1):
+    conn.execute("INSERT INTO ocr_cache_stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+                 (name, amount))
+
+
+def _cache_lookup(conn, digest, variant, phash):
+    row = conn.execute("SELECT texts FROM ocr_cache WHERE image_hash = ? AND variant = ?", (digest, variant)).fetchone()
+    stat = 'hits'
+    if row is None and phash is not None:
+        target = int(phash, 16)
+        for candidate, candidate_phash, texts in conn.execute(
+                "SELECT image_hash, phash, texts FROM ocr_cache WHERE variant = ? AND phash IS NOT NULL", (variant,)):
+            if bin(int(candidate_phash, 16) ^ target).count('1') <= OCR_CACHE_NEAR_DISTANCE:
+                digest, row, stat = candidate, (texts,), 'near_hits'
+                break
+    if row is None:
+        _bump_cache_stat(conn, 'misses')
+        return None
+    conn.execute("UPDATE ocr_cache SET last_used = ?, hits = hits + 1 WHERE image_hash = ? AND variant = ?",
+                 (time.time(), digest, variant))
+    _bump_cache_stat(conn, stat)
+    return json.loads(row[0])
+
+
+def _cache_store(conn, digest, variant, phash, texts):
+    now = time.time()
+    with conn:
+        conn.execute("BEGIN")
+        conn.execute("INSERT OR REPLACE INTO ocr_cache (image_hash, variant, phash, texts, created, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                     (digest, variant, phash, json.dumps(texts), now, now))
+        evicted = conn.execute("DELETE FROM ocr_cache WHERE last_used < ?",
+                               (now - OCR_CACHE_MAX_AGE_DAYS * 86400,)).rowcount
+        evicted += conn.execute("""DELETE FROM ocr_cache WHERE rowid IN (
+                                       SELECT rowid FROM ocr_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)""",
+                                (OCR_CACHE_MAX_ENTRIES,)).rowcount
+        if evicted:
+            _bump_cache_stat(conn, 'evictions', evicted)
+
+
+def ocr_cache_stats():
+    """Hit/miss/eviction counters and current size of the OCR result cache."""
+    stats = {'hits': 0, 'near_hits': 0, 'misses': 0, 'evictions': 0, 'entries': 0}
+    if not OCR_CACHE_PATH:
+        return stats
+    conn = _cache_conn()
+    stats.update(conn.execute("SELECT name, value FROM ocr_cache_stats").fetchall())
+    stats['entries'] = conn.execute("SELECT COUNT(*) FROM ocr_cache").fetchone()[0]
+    return stats
+
+
+def preprocess_fast(image):
+    """Crops a screenshot to its app list, converts it to grayscale and scales it down."""
+    width, height = image.size
+    left, top, right, bottom = OCR_FAST_CROP
+    cropped = image.crop((int(left * width), int(top * height), int(right * width), int(bottom * height)))
+    # Scale relative to the full screenshot so text size doesn't depend on the crop.
+    scale = min(1.0, OCR_FAST_TARGET_HEIGHT / height)
+    if scale < 1.0:
+        cropped = cropped.resize((max(1, int(cropped.width * scale)), max(1, int(cropped.height * scale))), Image.BILINEAR)
+    return cropped.convert('L')
+
+
+def _ocr_variant(fast, batched=False):
+    variant = "full" if not fast else f"fast:{OCR_FAST_TARGET_HEIGHT}:{OCR_FAST_CROP}:{OCR_FAST_ALLOWLIST}"
+    # The batched pipeline reads a rescaled, padded canvas, so its results are kept apart.
+    return f"{variant}:batch:{OCR_BATCH_WIDTH}" if batched else variant
+
+
+def read_text(image, fast=None):
+    """Returns the strings the OCR engine detects in a PIL image, via the result cache.
+
+    fast=None follows DETOX_OCR_FAST; results for the two modes are cached separately.
+    """
+    return read_texts([image], fast)[0]
+
+
+def read_texts(images, fast=None, batch_size=OCR_BATCH_SIZE):
+    """read_text for several images: cache hits are looked up one by one, and the
+    misses OCR'd batch_size at a time. Returns one list of strings per image, in order.
+
+    batch_size 1 reads each image on its own, as read_text does; above 1 every miss goes
+    through readtext_batched, even one left over on its own.
+    """
+    fast = OCR_FAST_MODE if fast is None else fast
+    batched = batch_size > 1
+    results = [None] * len(images)
+    misses = list(range(len(images)))
+    if OCR_CACHE_PATH:
+        conn = _cache_conn()
+        variant = _ocr_variant(fast, batched)
+        keys = {}
+        misses = []
+        for i, image in enumerate(images):
+            digest = image_hash(image)
+            phash = perceptual_hash(image) if OCR_CACHE_NEAR_DISTANCE > 0 else None
+            results[i] = _cache_lookup(conn, digest, variant, phash)
+            if results[i] is None:
+                incr("ocr.cache_miss")
+                keys[i] = (digest, phash)
+                misses.append(i)
+            else:
+                incr("ocr.cache_hit")
+
+    # Similar shapes side by side, so little of each batch's canvas is padding.
+    misses.sort(key=lambda i: images[i].height / images[i].width)
+    for start in range(0, len(misses), batch_size):
+        batch = misses[start:start + batch_size]
+        if batched:
+            found = _run_readtext_batched([images[i] for i in batch], fast)
+        else:
+            found = [_run_readtext(images[batch[0]], fast)]
+        for i, texts in zip(batch, found):
+            results[i] = texts
+            if OCR_CACHE_PATH:
+                _cache_store(conn, keys[i][0], variant, keys[i][1], texts)
+    return results
+
+
+@timed("ocr.readtext")
+def _run_readtext(image, fast=False):
+    import numpy as np
+
+    reader = get_ocr_reader()
+    options = {}
+    if fast:
+        image = preprocess_fast(image)
+        options['allowlist'] = OCR_FAST_ALLOWLIST
+    else:
+        image = image.convert('RGB')
+    # easyocr makes no thread-safety promises for a shared reader, so sessions take turns on it.
+    with _readtext_lock:
+        return reader.readtext(np.array(image), detail=0, **options)
+
+
+def to_canvas(images, width):
+    """Scales images to one width and pads each at the bottom to the tallest.
+
+    The padding takes the colour of the image's bottom-left pixel, so a dark-mode
+    screenshot gets a dark margin instead of an edge the detector could pick up.
+    """
+    scaled = [image if image.width == width else
+              image.resize((width, max(1, round(image.height * width / image.width))), Image.BILINEAR)
+              for image in images]
+    height = max(image.height for image in scaled)
+    canvases = []
+    for image in scaled:
+        if image.height < height:
+            canvas = Image.new(image.mode, (width, height), image.getpixel((0, image.height - 1)))
+            canvas.paste(image, (0, 0))
+            image = canvas
+        canvases.append(image)
+    return canvases
+
+
+@timed("ocr.readtext_batched")
+def _run_readtext_batched(images, fast=False):
+    """One detection pass and one recognition pass over several images."""
+    import numpy as np
+
+    reader = get_ocr_reader()
+    options = {}
+    if fast:
+        images = [preprocess_fast(image) for image in images]
+        options['allowlist'] = OCR_FAST_ALLOWLIST
+    else:
+        images = [image.convert('RGB') for image in images]
+    canvases = to_canvas(images, min(OCR_BATCH_WIDTH, max(image.width for image in images)))
+    with _readtext_lock:
+        return reader.readtext_batched([np.array(canvas) for canvas in canvases], detail=0,
+                                       batch_size=RECOGNITION_BATCH_SIZE, **options)
+
+
+@timed("ocr.parse")
+def parse_usage(texts):
+    """Turns OCR strings into (total, youtube, instagram, app_times) minutes."""
+    app_times = {}
+    current_app = None
+
+    for text in texts:
+        clean_text = text.strip()
+
+        match = TIME_PATTERN.fullmatch(clean_text)
+        is_time = False
+        minutes = 0
+
+        if match:
+            h_str, m_str = match.groups()
+            if h_str or m_str:
+                is_time = True
+                h = int(h_str) if h_str else 0
+                m = int(m_str) if m_str else 0
+                minutes = (h * 60) + m
+
+        if is_time and current_app and minutes > 0:
+            app_times[current_app.lower()] = minutes
+            current_app = None
+        elif not is_time and len(clean_text) > 2:
+            current_app = clean_text
+
+    youtube = app_times.get('youtube', 0)
+    instagram = app_times.get('instagram', 0)
+
+    detected_values = list(app_times.values())
+    if detected_values:
+        total = sum(detected_values)
+    else:
+        total = 0
+
+    return total, youtube, instagram, app_times
+
+
+def parse_ocr(image, fast=None):
+    """Extracts time data from screenshot: (total, youtube, instagram, minutes per app)."""
+    return parse_usage(read_text(image, fast))
+
+
+def parse_ocr_batch(images, fast=None, batch_size=OCR_BATCH_SIZE):
+    """parse_ocr for several screenshots, OCR'd batch_size at a time; results in input order."""
+    return [parse_usage(texts) for texts in read_texts(images, fast, batch_size)]
+
+
+def infer_screenshot_date(filename, texts, today=None):
+    """Guesses which day a screenshot covers, or returns None if nothing matches.
+
+    Phone screenshot names usually carry a timestamp (Screenshot_20250114-...), which
+    wins over the "Today" / "Yesterday" / "Tue, 14 Jan" headers Digital Wellbeing shows.
+    """
+    today = today or date.today()
+
+    match = FILENAME_DATE_PATTERN.search(filename or "")
+    if match:
+        try:
+            return date(*map(int, match.groups()))
+        except ValueError:
+            pass
+
+    for text in texts:
+        lowered = text.strip().lower()
+        if lowered == "today":
+            return today
+        if lowered == "yesterday":
+            return today - timedelta(days=1)
+
+        for match in TEXT_DATE_PATTERN.finditer(text):
+            day_a, month_a, month_b, day_b = match.groups()
+            word = (month_a or month_b).lower()
+            # Accept "Jan" or "January" but not app names that merely start like a month ("Decathlon").
+            month = next((i for name, i in MONTHS.items() if name.startswith(word)), None)
+            if not month:
+                continue
+            try:
+                found = date(today.year, month, int(day_a or day_b))
+            except ValueError:
+                continue
+            # Screenshots never come from the future, so "31 Dec" seen in January is last year.
+            if found > today:
+                found = found.replace(year=today.year - 1)
+            return found
+    return None
+
+
+def _init_ocr_worker(torch_threads):
+    import torch
+    torch.set_num_threads(torch_threads)
+    get_ocr_reader()
+
+
+def get_ocr_pool():
+    """Returns the process pool used for parallel OCR, starting it on first use.
+
+    A pool that lost a worker (a crash, the OOM killer, a failing initializer) refuses
+    all further work, so it is replaced by a fresh one.
+    """
+    global _pool
+    with _pool_lock:
+        # ProcessPoolExecutor has no public way to ask whether it is broken.
+        if _pool is not None and getattr(_pool, '_broken', False):
+            incr("ocr.pool_restart")
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+            _worker_info.clear()
+        if _pool is None:
+            # spawn rather than fork: the parent runs Streamlit's server threads and may
+            # already hold a torch thread pool, neither of which survives a fork.
+            torch_threads = max(1, (os.cpu_count() or 1) // OCR_WORKERS)
+            _pool = ProcessPoolExecutor(
+                max_workers=OCR_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_ocr_worker,
+                initargs=(torch_threads,),
+            )
+    return _pool
+
+
+def _screenshot_result(name, texts):
+    total, youtube, instagram, app_times = parse_usage(texts)
+    inferred = infer_screenshot_date(name, texts)
+    return {
+        'name': name,
+        'total': total,
+        'youtube': youtube,
+        'instagram': instagram,
+        'app_times': app_times,
+        'date': inferred.isoformat() if inferred else None,
+    }
+
+
+@timed("ocr.screenshot")
+def ocr_screenshot(name, data, fast=None):
+    """OCR for one encoded screenshot: minutes per app plus the inferred date, as a dict."""
+    return _screenshot_result(name, read_text(Image.open(io.BytesIO(data)), fast))
+
+
+@timed("ocr.screenshots")
+def ocr_screenshots(files, fast=None):
+    """ocr_screenshot for several (name, bytes) screenshots, OCR'd OCR_BATCH_SIZE at a time.
+
+    Returns a dict per file in order; one that can't be decoded gets {'name', 'error'}.
+    """
+    results, images, decoded = [], [], []
+    for name, data in files:
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.load()
+        except Exception as e:
+            results.append({'name': name, 'error': str(e)})
+            continue
+        results.append(None)
+        images.append(image)
+        decoded.append(len(results) - 1)
+    for i, texts in zip(decoded, read_texts(images, fast)):
+        results[i] = _screenshot_result(files[i][0], texts)
+    return results
+
+
+def ocr_batches(items, batch_size=OCR_BATCH_SIZE):
+    """Splits items into batches of at most batch_size, smaller if that keeps more workers busy."""
+    size = max(1, min(batch_size, -(-len(items) // OCR_WORKERS)))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def parse_ocr_files(files, fast=None, batch_size=OCR_BATCH_SIZE):
+    """Runs OCR over (name, bytes) pairs on the worker pool, each worker reading a batch at a time.
+
+    Yields one result dict per file as its batch completes, so callers can report
+    progress. A file that fails yields {'name': ..., 'error': message} instead.
+    """
+    pool = get_ocr_pool()
+    futures = {pool.submit(ocr_screenshots, batch, fast): batch for batch in ocr_batches(list(files), batch_size)}
+    for future in as_completed(futures):
+        try:
+            yield from future.result()
+        except Exception as e:
+            for name, _ in futures[future]:
+                yield {'name': name, 'error': str(e)}
@@ -0,0 +1,208 @@
+import csv
+import time
+from pathlib import Path
+
+from detox_challenges import rebuild_challenge_progress
+from detox_core import EXPORT_CHUNK_ROWS, export_chunks
+from detox_db import bump_state_version, get_conn, run_many, run_query, transaction, user_filter
+from detox_forecast import rebuild_trend_stats
+from detox_leaderboard import rebuild_weekly_stats
+from detox_ledger import book_imported_balances
+from detox_metrics import timed
+from detox_usage import backfill_app_usage
+
+
+# Bulk copies of user history to and from CSV or Parquet files, a chunk at a time, so
+# memory stays flat however big the table. Parquet needs pyarrow, which is optional.
+FORMATS = ('csv', 'parquet')
+# Tables holding source data, in the order they must be loaded. Everything else is
+# derived from them and rebuilt after an import.
+IMPORT_TABLES = ('users', 'daily_logs', 'app_usage', 'challenges_log')
+IMPORT_BATCH_ROWS = 5000
+IMPORT_TRANSACTION_ROWS = 100000
+# Imported users whose derived tables are rebuilt per transaction.
+REBUILD_CHUNK_USERS = 2000
+CONFLICT_VERBS = {
+    'skip': "INSERT OR IGNORE",    # rows already in the database win
+    'replace': "INSERT OR REPLACE",  # rows in the file win
+}
+ARROW_TYPES = {'INTEGER': 'int64', 'REAL': 'float64', 'TEXT': 'string', 'BLOB': 'binary'}
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet files need pyarrow: pip install pyarrow") from None
+    return pyarrow
+
+
+def file_format(path, fmt=None):
+    """The format named, else the one the file's extension implies (CSV by default)."""
+    fmt = fmt or ('parquet' if Path(str(path)).suffix.lower() in ('.parquet', '.pq') else 'csv')
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format {fmt!r}; choose from {', '.join(FORMATS)}")
+    return fmt
+
+
+def _column_types(table):
+    """{column: declared type} from the live schema."""
+    return {name: col_type.upper() for _, name, col_type, _, _, _ in run_query(f"PRAGMA table_info({table})", fetch=True)}
+
+
+def _report(rows, start, **extra):
+    seconds = time.perf_counter() - start
+    return {'rows': rows, **extra, 'seconds': seconds, 'rows_per_second': rows / seconds if seconds else 0.0}
+
+
+@timed("transfer.export")
+def export_table(table, out, fmt=None, username=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """Streams a table (optionally one user's rows) to a CSV or Parquet file.
+
+    out is a path, or for CSV an open text file such as stdout. Each chunk of rows
+    becomes one Parquet row group. Returns {'rows', 'seconds', 'rows_per_second'}.
+    """
+    fmt = file_format('' if hasattr(out, 'write') else out, fmt)
+    pa = _pyarrow() if fmt == 'parquet' else None
+    start = time.perf_counter()
+    chunks = export_chunks(table, username, chunk_rows)
+    columns = next(chunks)
+    rows = 0
+    if fmt == 'csv':
+        f = out if hasattr(out, 'write') else open(out, 'w', newline='', encoding='utf-8')
+        try:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for chunk in chunks:
+                writer.writerows(chunk)
+                rows += len(chunk)
+        finally:
+            if f is not out:
+                f.close()
+    else:
+        types = _column_types(table)
+        schema = pa.schema([(name, getattr(pa, ARROW_TYPES.get(types[name], 'string'))()) for name in columns])
+        with pa.parquet.ParquetWriter(out, schema) as writer:
+            for chunk in chunks:
+                writer.write_table(pa.Table.from_arrays(
+                    [pa.array(values, field.type) for values, field in zip(zip(*chunk), schema)], schema=schema))
+                rows += len(chunk)
+    return _report(rows, start)
+
+
+def _read_batches(path, fmt, batch_rows, types):
+    """Yields the file's column names, then lists of up to batch_rows row tuples."""
+    if fmt == 'csv':
+        with open(path, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            columns = next(reader, None)
+            if columns is None:
+                raise ValueError(f"{path} is empty")
+            yield columns
+            # CSV has no NULL: an empty field is NULL, except in TEXT columns where it may be a real ''.
+            nullable = [types.get(name) != 'TEXT' for name in columns]
+            batch = []
+            for row in reader:
+                batch.append(tuple(None if value == '' and null else value for value, null in zip(row, nullable)))
+                if len(batch) >= batch_rows:
+                    yield batch
+                    batch = []
+            if batch:
+                yield batch
+    else:
+        parquet = _pyarrow().parquet.ParquetFile(path)
+        yield parquet.schema_arrow.names
+        for batch in parquet.iter_batches(batch_size=batch_rows):
+            yield list(zip(*(column.to_pylist() for column in batch.columns)))
+
+
+def _import_one(table, path, fmt, verb, batch_rows, transaction_rows):
+    """Loads one file into table; returns (rows read, rows written)."""
+    types = _column_types(table)
+    keys = [name for _, name, _, _, _, pk in run_query(f"PRAGMA table_info({table})", fetch=True) if pk]
+    batches = _read_batches(path, fmt, batch_rows, types)
+    columns = next(batches)
+    problems = ([f"unknown column {name}" for name in columns if name not in types]
+                + [f"no {name} column" for name in keys if name not in columns])
+    if problems:
+        raise ValueError(f"{path} doesn't match {table}: {', '.join(problems)}")
+    user_at = columns.index('username')
+    placeholders = ", ".join("?" for _ in columns)
+    if table == 'users':
+        query, params = f"{verb} INTO users ({', '.join(columns)}) VALUES ({placeholders})", lambda row: row
+    else:
+        # Rows of users who don't exist are skipped rather than left orphaned.
+        query = (f"{verb} INTO {table} ({', '.join(columns)}) SELECT {placeholders} "
+                 "WHERE EXISTS (SELECT 1 FROM users WHERE username = ?)")
+        params = lambda row: row + (row[user_at],)
+
+    conn = get_conn()
+    rows = inserted = 0
+    done = False
+    while not done:
+        # One transaction per transaction_rows rows: big enough to amortise the commit,
+        # small enough that the app isn't locked out for the whole import.
+        with transaction():
+            in_transaction = 0
+            while in_transaction < transaction_rows:
+                batch = next(batches, None)
+                if batch is None:
+                    done = True
+                    break
+                changes = conn.total_changes
+                run_many(query, [params(row) for row in batch])
+                inserted += conn.total_changes - changes
+                run_many("INSERT OR IGNORE INTO imported_users VALUES (?)", {(row[user_at],) for row in batch})
+                in_transaction += len(batch)
+            rows += in_transaction
+    return rows, inserted
+
+
+@timed("transfer.import")
+def import_tables(sources, on_conflict='skip', batch_rows=IMPORT_BATCH_ROWS, transaction_rows=IMPORT_TRANSACTION_ROWS):
+    """Loads [(table, path)] CSV or Parquet files made by export_table, users first.
+
+    Rows go in with batched executemany, in transactions of about transaction_rows rows.
+    A row whose key already exists is kept (on_conflict='skip') or overwritten ('replace').
+    Afterwards, for the imported users only and REBUILD_CHUNK_USERS of them per transaction,
+    the derived tables are rebuilt, points and wallets are booked to the ledger, and
+    logs_version and state_version are bumped. Import app_usage along with daily_logs to
+    keep every app; without it only YouTube and Instagram are filled in.
+    Returns {table: {'rows', 'inserted', 'skipped', 'seconds', 'rows_per_second'}, 'rebuild_seconds': ...}.
+    """
+    verb = CONFLICT_VERBS[on_conflict]
+    for table, _ in sources:
+        if table not in IMPORT_TABLES:
+            raise ValueError(f"Can't import {table!r}; choose from {', '.join(IMPORT_TABLES)}")
+    run_query("CREATE TEMP TABLE IF NOT EXISTS imported_users (username TEXT PRIMARY KEY)")
+    run_query("DELETE FROM imported_users")
+
+    report = {}
+    for table, path in sorted(sources, key=lambda source: IMPORT_TABLES.index(source[0])):
+        fmt = file_format(path)
+        if fmt == 'parquet':
+            _pyarrow()
+        start = time.perf_counter()
+        rows, inserted = _import_one(table, path, fmt, verb, batch_rows, transaction_rows)
+        report[table] = _report(rows, start, inserted=inserted, skipped=rows - inserted)
+
+    start = time.perf_counter()
+    tables = {table for table, _ in sources}
+    imported = [name for (name,) in run_query("SELECT username FROM imported_users ORDER BY username", fetch=True)]
+    for i in range(0, len(imported), REBUILD_CHUNK_USERS):
+        chunk = imported[i:i + REBUILD_CHUNK_USERS]
+        with transaction():
+            if 'daily_logs' in tables and 'app_usage' not in tables:
+                # Days with no per-app detail still get their YouTube and Instagram rows.
+                backfill_app_usage(chunk)
+            if 'users' in tables:
+                book_imported_balances(chunk)
+            rebuild_challenge_progress(usernames=chunk)
+            rebuild_trend_stats(usernames=chunk)
+            rebuild_weekly_stats(usernames=chunk)
+            where, params = user_filter(usernames=chunk)
+            run_query(f"UPDATE users SET logs_version = logs_version + 1 {where}", params)
+            bump_state_version(chunk)
+    report['rebuild_seconds'] = time.perf_counter() - start
+    return report
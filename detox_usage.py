@@ -0,0 +1,50 @@
+from detox_db import run_many, run_query, transaction, user_filter
+
+
+# app_usage keeps every app read off a screenshot, one row per (user, day, app). App names are
+# stored lowercased, the way parse_usage reports them. daily_logs keeps the day's totals.
+
+
+def save_app_usage(username, date_str, app_times):
+    """Replaces the user's per-app minutes for one day."""
+    with transaction():
+        run_query("DELETE FROM app_usage WHERE username = ? AND date = ?", (username, date_str))
+        run_many("INSERT INTO app_usage (username, date, app, minutes) VALUES (?, ?, ?, ?)",
+                 [(username, date_str, app.lower(), minutes) for app, minutes in app_times.items() if minutes > 0])
+
+
+def log_app_times(log):
+    """The per-app minutes of a log dict; logs without OCR detail fall back to the fixed columns."""
+    if log.get('app_times'):
+        return log['app_times']
+    return {'youtube': log.get('youtube', 0), 'instagram': log.get('instagram', 0)}
+
+
+def get_day_usage(username, date_str):
+    """{app: minutes} for one day."""
+    return dict(run_query("SELECT app, minutes FROM app_usage WHERE username = ? AND date = ?", (username, date_str), fetch=True))
+
+
+def get_app_series(username, app, start=None, end=None):
+    """[(date, minutes)] for one app, oldest first, optionally within [start, end]."""
+    return run_query('''SELECT date, minutes FROM app_usage
+                        WHERE username = ? AND app = ? AND date BETWEEN ? AND ?
+                        ORDER BY date''', (username, app.lower(), start or '', end or '9999-12-31'), fetch=True)
+
+
+def get_top_apps(username, start=None, end=None, limit=10):
+    """[(app, total minutes, days used)] for the user's most-used apps within [start, end]."""
+    return run_query('''SELECT app, SUM(minutes) AS total, COUNT(*) FROM app_usage
+                        WHERE username = ? AND date BETWEEN ? AND ?
+                        GROUP BY app ORDER BY total DESC LIMIT ?''',
+                     (username, start or '', end or '9999-12-31', limit), fetch=True)
+
+
+def backfill_app_usage(usernames=None):
+    """Seeds app_usage from the youtube/instagram columns of days logged before it existed,
+    for the users listed or everyone."""
+    where, params = user_filter(usernames=usernames)
+    for app, column in (('youtube', 'youtube_minutes'), ('instagram', 'instagram_minutes')):
+        run_query(f'''INSERT OR IGNORE INTO app_usage (username, date, app, minutes)
+                      SELECT username, date, ?, {column} FROM daily_logs
+                      WHERE {column} > 0 {where.replace("WHERE", "AND", 1)}''', (app,) + params)
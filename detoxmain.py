@@ -1,18 +1,34 @@
-import streamlit as st
-import pandas as pd
-import sqlite3
-import hashlib
 import time
+_script_started = time.perf_counter()
+
+import os
+import streamlit as st
 import random
-import easyocr
-import numpy as np
 from PIL import Image
-import re
-from datetime import datetime, timedelta
-import plotly.express as px
-import plotly.graph_objects as go
-from sklearn.linear_model import LinearRegression
-
+from datetime import datetime
+
+from detox_challenges import CHALLENGES, get_challenge_status
+from detox_core import (challenge_points, default_history_range, get_history_bounds, get_history_rollup, get_state_version,
+                        get_user_stats, login_user, register_user, reset_user_progress, save_daily_logs, time_to_str)
+from detox_db import init_db
+from detox_forecast import HISTORY_WINDOW_DAYS, MIN_DAYS_FOR_FORECAST, forecast_from_stats, get_recent_totals, get_trend_stats
+from detox_jobs import get_ocr_jobs, resume_ocr_jobs, submit_ocr_jobs
+from detox_leaderboard import ALL_TIME, current_week, get_leaderboard, get_my_rank
+from detox_ledger import redeem_points, withdraw_funds
+from detox_metrics import incr, record, timer
+from detox_usage import get_app_series, get_top_apps
+from detox_ocr import warm_up_ocr, ocr_worker_info, ocr_cache_stats
+# pandas, plotly, numpy and easyocr are imported by the pages that use them, keeping the login page fast.
+_imports_done = time.perf_counter()
+
+STARTUP_REPORT = os.environ.get("DETOX_STARTUP_REPORT", "0") == "1"
+# Longest range drawn one bar per day; longer ones switch to weekly bars.
+MAX_DAILY_BARS = 120
+# Rankings move with everyone's activity, so they're shared between sessions and refreshed this often.
+LEADERBOARD_TTL_SECONDS = 60
+# Likewise the OCR cache counters on the Log Data page, also refreshed when this session's scans finish.
+OCR_CACHE_STATS_TTL_SECONDS = 60
+_page = "Login"  # what this run rendered, for the per-page timings
 
 st.set_page_config(page_title="Detoxify - Gamified Screen Time", page_icon="🎮", layout="wide")
 
@@ -33,225 +49,118 @@ SCREEN_TIME_TIPS = [
 ]
 
 
-def init_db():
-    conn = sqlite3.connect('detox_users.db')
-    c = conn.cursor()
-
-    c.execute('''CREATE TABLE IF NOT EXISTS users (
-                    username TEXT PRIMARY KEY, 
-                    password TEXT, 
-                    points INTEGER, 
-                    balance_inr REAL,
-                    baseline_screentime INTEGER
-                )''')
-
-    c.execute('''CREATE TABLE IF NOT EXISTS daily_logs (
-                    username TEXT,
-                    date TEXT,
-                    total_minutes INTEGER,
-                    youtube_minutes INTEGER,
-                    instagram_minutes INTEGER,
-                    PRIMARY KEY (username, date)
-                )''')
-
-    c.execute('''CREATE TABLE IF NOT EXISTS challenges_log (
-                    username TEXT,
-                    challenge_id TEXT,
-                    date TEXT,
-                    PRIMARY KEY (username, challenge_id, date)
-                )''')
-    conn.commit()
-    conn.close()
-
-def run_query(query, params=(), fetch=False):
-    conn = sqlite3.connect('detox_users.db')
-    c = conn.cursor()
-    c.execute(query, params)
-    if fetch:
-        data = c.fetchall()
-        conn.close()
-        return data
-    conn.commit()
-    conn.close()
-
-
-def reset_user_progress(username):
-    """Resets all logs, points, and challenge history for a specific user."""
-    conn = sqlite3.connect('detox_users.db')
-    c = conn.cursor()
-    c.execute("DELETE FROM daily_logs WHERE username = ?", (username,))
-    c.execute("DELETE FROM challenges_log WHERE username = ?", (username,))
-    c.execute("UPDATE users SET points = 0, balance_inr = 0.0 WHERE username = ?", (username,))
-    conn.commit()
-    conn.close()
+def reset_progress(username):
+    reset_user_progress(username)
     st.toast("♻️ Account Reset Successful! All progress wiped.", icon="🗑️")
     time.sleep(1)
 
 
-def make_hashes(password):
-    return hashlib.sha256(str.encode(password)).hexdigest()
-
-def check_hashes(password, hashed_text):
-    if make_hashes(password) == hashed_text:
-        return hashed_text
-    return False
-
-def register_user(username, password):
-    try:
-        run_query("INSERT INTO users (username, password, points, balance_inr, baseline_screentime) VALUES (?, ?, ?, ?, ?)", 
-                  (username, make_hashes(password), 0, 0.0, 300)) # default is 300
-        return True
-    except sqlite3.IntegrityError:
-        return False
-
-def login_user(username, password):
-    data = run_query("SELECT * FROM users WHERE username = ?", (username,), fetch=True)
-    if data:
-        if check_hashes(password, data[0][1]):
-            return data[0]
-    return None
-
-
-def get_user_stats(username):
-    data = run_query("SELECT points, balance_inr, baseline_screentime FROM users WHERE username = ?", (username,), fetch=True)
-    return data[0] if data else (0, 0.0, 300)
-
-def add_points(username, amount):
-    current_stats = get_user_stats(username)
-    new_points = current_stats[0] + amount
-    run_query("UPDATE users SET points = ? WHERE username = ?", (new_points, username))
-    st.toast(f"🎉 +{amount} Points Earned!", icon="🪙")
-
-def time_to_str(mins):
-    h, m = divmod(mins, 60)
-    return f"{h}h {m}m"
-
-def parse_ocr(image):
-    """Extracts time data from screenshot with app-specific matching"""
-    reader = easyocr.Reader(['en'], gpu=False)
-    result = reader.readtext(np.array(image), detail=0)
-
-    app_times = {}
-    current_app = None
-
-    time_pattern = re.compile(r'(?:(\d+)\s*[hH]\s*)?(?:(\d+)\s*[mM])?')
-
-    for text in result:
-        clean_text = text.strip()
-
-        match = time_pattern.fullmatch(clean_text)
-        is_time = False
-        minutes = 0
-        
-        if match:
-            h_str, m_str = match.groups()
-            if h_str or m_str:
-                is_time = True
-                h = int(h_str) if h_str else 0
-                m = int(m_str) if m_str else 0
-                minutes = (h * 60) + m
-
-        if is_time and current_app and minutes > 0:
-            app_times[current_app.lower()] = minutes
-            current_app = None
-        elif not is_time and len(clean_text) > 2:
-            current_app = clean_text
-
-    youtube = app_times.get('youtube', 0)
-    instagram = app_times.get('instagram', 0)
-    
-    detected_values = list(app_times.values())
-    if detected_values:
-        total = sum(detected_values)
+def save_logs(username, logs):
+    """Saves logs through the core and celebrates any challenges they completed."""
+    completed = save_daily_logs(username, logs)
+    if completed:
+        st.toast(f"🎉 +{challenge_points(completed)} Points Earned!", icon="🪙")
+    for cid in completed:
+        st.toast(f"🏆 Challenge {cid} Completed! +{CHALLENGES[cid]['points']} Points!", icon="🎉")
+
+
+# Cached per user and logs_version, which every write to the user's daily_logs bumps,
+# so a new or replaced log is picked up on the next rerun and nothing is ever stale.
+@st.cache_data(max_entries=512, show_spinner=False)
+def cached_history(username, logs_version, grain, start, end):
+    return get_history_rollup(username, grain, start, end)
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def cached_history_bounds(username, logs_version):
+    return get_history_bounds(username)
+
+@st.cache_data(ttl=LEADERBOARD_TTL_SECONDS, show_spinner=False)
+def cached_leaderboard(board, week):
+    return get_leaderboard(board, week, 10)
+
+@st.cache_data(ttl=OCR_CACHE_STATS_TTL_SECONDS, show_spinner=False)
+def cached_ocr_cache_stats():
+    return ocr_cache_stats()
+
+@st.cache_data(ttl=LEADERBOARD_TTL_SECONDS, max_entries=2048, show_spinner=False)
+def cached_my_rank(username, state_version, board, week):
+    return get_my_rank(username, board, week)
+
+
+def user_state(username):
+    """The signed-in user's stats and page data, held in the session.
+
+    A rerun costs one query, the state_version check. Everything else is loaded again only
+    after a write to this user, from any session or the CLI, has moved the version.
+    """
+    version = get_state_version(username)
+    state = st.session_state.get('user_state')
+    if state is None or state['username'] != username or state['version'] != version:
+        incr("session.state_load")
+        points, balance, baseline, logs_version = get_user_stats(username)
+        state = {'username': username, 'version': version, 'points': points, 'balance': balance,
+                 'baseline': baseline, 'logs_version': logs_version, 'data': {}}
+        st.session_state['user_state'] = state
+    return state
+
+def from_state(state, key, load):
+    """load() once per state version; key names it and the arguments it depends on."""
+    if key not in state['data']:
+        state['data'][key] = load()
+    return state['data'][key]
+
+
+def start_ocr_jobs(username, files, mode):
+    """Queues uploaded (name, bytes) screenshots and remembers the job ids in the session."""
+    job_ids = submit_ocr_jobs(username, files)
+    accepted = [job_id for job_id in job_ids if job_id]
+    if len(accepted) < len(job_ids):
+        st.warning(f"The scanner is busy: {len(job_ids) - len(accepted)} screenshot(s) weren't queued. Please upload them again in a minute.")
+    if accepted:
+        st.session_state['ocr_jobs'] = accepted
+        st.session_state['ocr_jobs_mode'] = mode
+        st.session_state.pop('ocr_results', None)
+        st.session_state.pop('ocr_error', None)
+        st.session_state.pop('bulk_results', None)
+
+@st.fragment(run_every=1)
+def poll_ocr_jobs():
+    """Re-runs on its own every second until the session's OCR jobs finish, then hands the results to the page."""
+    job_ids = st.session_state['ocr_jobs']
+    jobs = get_ocr_jobs(job_ids)
+    finished = [job_id for job_id in job_ids if job_id not in jobs or jobs[job_id]['status'] in ('done', 'failed')]
+    st.progress(len(finished) / len(job_ids), text=f"Scanning... {len(finished)}/{len(job_ids)} screenshots done")
+    if len(finished) < len(job_ids):
+        return
+
+    results = []
+    for job_id in job_ids:
+        job = jobs.get(job_id)
+        if job is None:
+            results.append({'name': "?", 'error': "This scan expired, please upload the screenshot again."})
+        elif job['status'] == 'failed':
+            results.append({'name': job['name'], 'error': job['error']})
+        else:
+            results.append(job['result'])
+
+    del st.session_state['ocr_jobs']
+    cached_ocr_cache_stats.clear()
+    if st.session_state.pop('ocr_jobs_mode') == 'single':
+        res = results[0]
+        if 'error' in res:
+            st.session_state['ocr_error'] = res['error']
+        else:
+            st.session_state['ocr_results'] = {'total': res['total'], 'youtube': res['youtube'], 'instagram': res['instagram'], 'app_times': res['app_times']}
     else:
-        total = 0
-
-    return total, youtube, instagram
-
-
-CHALLENGES = {
-    "C1": {
-        "title": "The 10% Cut", 
-        "desc": "Reduce screentime by 10% per day for 1 week.", 
-        "points": 25, 
-        "difficulty": "EASY", 
-        "days": 7,
-        "reward_text": "+25 pts/week"
-    },
-    "C2": {
-        "title": "YouTube Diet", 
-        "desc": "Keep YouTube under 3 hours per day for 2 weeks.", 
-        "points": 50, 
-        "difficulty": "MEDIUM", 
-        "days": 14,
-        "reward_text": "+50 pts/2 weeks"
-    },
-    "C3": {
-        "title": "Monk Mode", 
-        "desc": "Total screentime under 2 hours per day for 1 month.", 
-        "points": 100, 
-        "difficulty": "HARD", 
-        "days": 30,
-        "reward_text": "+100 pts/1 month"
-    },
-    "C4": {
-        "title": "Reel Rehab", 
-        "desc": "Keep Instagram under 3 hours per day for 2 weeks.", 
-        "points": 50, 
-        "difficulty": "MEDIUM", 
-        "days": 14,
-        "reward_text": "+50 pts/2 weeks"
-    }
-}
-
-def check_challenges(username, today_log):
-    stats = get_user_stats(username)
-    baseline = stats[2]
-    today_str = datetime.now().strftime("%Y-%m-%d")
-    
-    completed_today = run_query("SELECT challenge_id FROM challenges_log WHERE username = ? AND date = ?", (username, today_str), fetch=True)
-    completed_ids = [x[0] for x in completed_today]
-    
-    # 1. Challenge 1 (Total)
-    if "C1" not in completed_ids:
-        target = baseline * 0.9
-        if today_log['total'] > 0 and today_log['total'] <= target:
-            run_query("INSERT INTO challenges_log VALUES (?, ?, ?)", (username, "C1", today_str))
-            count = run_query("SELECT COUNT(*) FROM challenges_log WHERE username = ? AND challenge_id = ?", (username, "C1"), fetch=True)[0][0]
-            if count == CHALLENGES["C1"]["days"]:
-                add_points(username, CHALLENGES["C1"]["points"])
-                st.toast(f"🏆 Challenge C1 Completed! +{CHALLENGES['C1']['points']} Points!", icon="🎉")
-
-    # 2. Challenge 2 (YouTube)
-    if "C2" not in completed_ids:
-        if today_log['total'] > 0 and today_log['youtube'] <= 180:
-            run_query("INSERT INTO challenges_log VALUES (?, ?, ?)", (username, "C2", today_str))
-            count = run_query("SELECT COUNT(*) FROM challenges_log WHERE username = ? AND challenge_id = ?", (username, "C2"), fetch=True)[0][0]
-            if count == CHALLENGES["C2"]["days"]:
-                add_points(username, CHALLENGES["C2"]["points"])
-                st.toast(f"🏆 Challenge C2 Completed! +{CHALLENGES['C2']['points']} Points!", icon="🎉")
-
-    # 3. Challenge 3 (Total Hard)
-    if "C3" not in completed_ids:
-        if today_log['total'] > 0 and today_log['total'] <= 120:
-            run_query("INSERT INTO challenges_log VALUES (?, ?, ?)", (username, "C3", today_str))
-            count = run_query("SELECT COUNT(*) FROM challenges_log WHERE username = ? AND challenge_id = ?", (username, "C3"), fetch=True)[0][0]
-            if count == CHALLENGES["C3"]["days"]:
-                add_points(username, CHALLENGES["C3"]["points"])
-                st.toast(f"🏆 Challenge C3 Completed! +{CHALLENGES['C3']['points']} Points!", icon="🎉")
-
-    # 4. Challenge 4 (Instagram)
-    if "C4" not in completed_ids:
-        if today_log['total'] > 0 and today_log['instagram'] <= 180:
-            run_query("INSERT INTO challenges_log VALUES (?, ?, ?)", (username, "C4", today_str))
-            count = run_query("SELECT COUNT(*) FROM challenges_log WHERE username = ? AND challenge_id = ?", (username, "C4"), fetch=True)[0][0]
-            if count == CHALLENGES["C4"]["days"]:
-                add_points(username, CHALLENGES["C4"]["points"])
-                st.toast(f"🏆 Challenge C4 Completed! +{CHALLENGES['C4']['points']} Points!", icon="🎉")
+        st.session_state['bulk_results'] = sorted(results, key=lambda r: r['name'])
+    st.rerun()
 
 
 def main():
+    global _page
     init_db()
+    warm_up_ocr()
+    resume_ocr_jobs()
     
     if 'logged_in' not in st.session_state:
         st.session_state['logged_in'] = False
@@ -285,33 +194,39 @@ def main():
                 base_time = st.number_input("Avg Daily Screentime (mins)", value=300)
                 submit_reg = st.form_submit_button("Register")
                 if submit_reg:
-                    if register_user(new_user, new_pass):
-                        run_query("UPDATE users SET baseline_screentime = ? WHERE username = ?", (base_time, new_user))
+                    if register_user(new_user, new_pass, base_time):
                         st.success("Account created! Please Login.")
                     else:
                         st.error("Username already taken.")
+
+        if STARTUP_REPORT:
+            st.caption(f"⏱️ Page ready in {(time.perf_counter() - _script_started) * 1000:.0f} ms "
+                       f"(imports {(_imports_done - _script_started) * 1000:.0f} ms)")
                         
     else:
         user = st.session_state['username']
-        stats = get_user_stats(user)
-        points = stats[0]
-        balance = stats[1]
-        baseline = stats[2]
+        state = user_state(user)
+        points = state['points']
+        balance = state['balance']
+        baseline = state['baseline']
+        logs_version = state['logs_version']
         
         with st.sidebar:
             st.title(f"Hi, {user}!")
             st.metric("Points", points, delta_color="off")
             st.metric("Wallet Balance", f"₹{balance:.2f}")
             st.markdown("---")
-            menu = st.radio("Navigate", ["Dashboard", "Log Data", "Challenges", "Prediction", "Rewards Store", "Withdraw Funds"])
+            menu = st.radio("Navigate", ["Dashboard", "Log Data", "Challenges", "Leaderboard", "Prediction", "Rewards Store", "Withdraw Funds"])
+            _page = menu
             
             st.markdown("---")
             if st.button("⚠️ Reset Progress (Debug)", type="primary"):
-                reset_user_progress(user)
+                reset_progress(user)
                 st.rerun()
                 
             if st.button("Logout"):
                 st.session_state['logged_in'] = False
+                st.session_state.pop('user_state', None)
                 if 'daily_tip' in st.session_state:
                     del st.session_state['daily_tip']
                 st.rerun()
@@ -323,18 +238,45 @@ def main():
             col2.metric("Current Points", points)
             col3.metric("Redeemable Value", f"₹{(points / 100):.2f}")
             
-            history = run_query("SELECT date, total_minutes, youtube_minutes, instagram_minutes FROM daily_logs WHERE username = ? ORDER BY date", (user,), fetch=True)
-            if history:
-                df = pd.DataFrame(history, columns=['Date', 'Total Time', 'YouTube Time', 'Instagram Time'])
+            first_day, last_day = cached_history_bounds(user, logs_version)
+            if first_day:
+                import pandas as pd
+                import plotly.express as px
+
+                first_day = datetime.strptime(first_day, "%Y-%m-%d").date()
+                last_day = datetime.strptime(last_day, "%Y-%m-%d").date()
+                col_range, col_grain = st.columns([3, 1])
+                picked = col_range.date_input("Date Range", value=default_history_range(first_day, last_day),
+                                              min_value=first_day, max_value=last_day)
+                grain = col_grain.selectbox("Group By", ["Day", "Week", "Month"])
+                # While a range is being picked only its start is set.
+                start, end = (picked[0], picked[-1]) if isinstance(picked, (tuple, list)) and picked else (first_day, last_day)
+                if grain == "Day" and (end - start).days >= MAX_DAILY_BARS:
+                    grain = "Week"
+                    st.caption(f"Showing weekly averages: daily bars are limited to {MAX_DAILY_BARS} days.")
+
+                history = cached_history(user, logs_version, grain.lower(), start.isoformat(), end.isoformat())
+                df = pd.DataFrame(history, columns=['Date', 'Total Time', 'YouTube Time', 'Instagram Time', 'Days Logged'])
                 
-                fig = px.bar(
-                    df, 
-                    x='Date', 
-                    y=['Total Time', 'YouTube Time', 'Instagram Time'], 
-                    barmode='group', 
-                    title="Your Digital History"
-                )
+                with timer("dashboard.figure"):
+                    fig = px.bar(
+                        df, 
+                        x='Date', 
+                        y=['Total Time', 'YouTube Time', 'Instagram Time'], 
+                        barmode='group', 
+                        title="Your Digital History" if grain == "Day" else f"Your Digital History (daily average per {grain.lower()})",
+                        hover_data=['Days Logged']
+                    )
                 st.plotly_chart(fig, use_container_width=True)
+
+                top_apps = from_state(state, ('top_apps', start, end), lambda: get_top_apps(user, start.isoformat(), end.isoformat()))
+                if top_apps:
+                    app = st.selectbox("Per-App History", [name for name, _, _ in top_apps], format_func=str.title)
+                    series = from_state(state, ('app_series', app, start, end), lambda: get_app_series(user, app, start.isoformat(), end.isoformat()))
+                    app_df = pd.DataFrame(series, columns=['Date', 'Minutes'])
+                    with timer("dashboard.figure"):
+                        app_fig = px.line(app_df, x='Date', y='Minutes', markers=True, title=f"{app.title()} per Day")
+                    st.plotly_chart(app_fig, use_container_width=True)
             else:
                 st.info("No data logged yet. Go to 'Log Data' to start!")
             
@@ -345,80 +287,101 @@ def main():
             st.title("📝 Log Today's Activity")
             st.write("Upload your phone's 'Digital Wellbeing' or 'Screen Time' summary.")
             
-            img_file = st.file_uploader("Upload Screenshot", type=['png', 'jpg', 'jpeg'])
-            
-            if img_file:
-                image = Image.open(img_file)
-                st.image(image, caption="Uploaded Image", width=200)
-                
-                if st.button("Analyze Image"):
-                    with st.spinner("Scanning..."):
-                        try:
-                            t_ocr, yt_ocr, insta_ocr = parse_ocr(image)
-                            st.session_state['ocr_results'] = {'total': t_ocr, 'youtube': yt_ocr, 'instagram': insta_ocr}
-                        except Exception as e:
-                            st.error(f"OCR Error: {e}")
-
-                if 'ocr_results' in st.session_state:
-                    res = st.session_state['ocr_results']
-                    st.info(f"**Analysis Result:** Total: {res['total']} mins | YouTube: {res['youtube']} mins | Instagram: {res['instagram']} mins")
+            upload_mode = st.radio("Upload", ["Single Day", "Several Days"], horizontal=True)
+
+            workers = ocr_worker_info()
+            if workers:
+                load_seconds = sum(w['load_seconds'] for w in workers) / len(workers)
+                footprints = [w['footprint_mb'] for w in workers if w['footprint_mb'] is not None]
+                footprint = f"~{sum(footprints) / len(footprints):.0f} MB each" if footprints else "unknown size"
+                st.caption(f"OCR workers ready: {len(workers)} (loaded in {load_seconds:.1f}s, {footprint})")
+            cache = cached_ocr_cache_stats()
+            if cache['entries']:
+                st.caption(f"OCR cache: {cache['entries']} screenshots, {cache['hits'] + cache['near_hits']} hits / {cache['misses']} misses")
+
+            if upload_mode == "Single Day":
+                img_file = st.file_uploader("Upload Screenshot", type=['png', 'jpg', 'jpeg'])
+
+                if img_file:
+                    image = Image.open(img_file)
+                    st.image(image, caption="Uploaded Image", width=200)
                     
-                    if st.button("Confirm & Save This Data"):
-                        date_str = datetime.now().strftime("%Y-%m-%d")
-                        run_query("INSERT OR REPLACE INTO daily_logs VALUES (?, ?, ?, ?, ?)", 
-                                  (user, date_str, res['total'], res['youtube'], res['instagram']))
-                        
-                        check_challenges(user, {'total': res['total'], 'youtube': res['youtube'], 'instagram': res['instagram']})
+                    if st.button("Analyze Image", disabled='ocr_jobs' in st.session_state):
+                        start_ocr_jobs(user, [(img_file.name, img_file.getvalue())], 'single')
+
+                    if 'ocr_error' in st.session_state:
+                        st.error(f"OCR Error: {st.session_state['ocr_error']}")
+
+                    if 'ocr_results' in st.session_state:
+                        res = st.session_state['ocr_results']
+                        st.info(f"**Analysis Result:** Total: {res['total']} mins | YouTube: {res['youtube']} mins | Instagram: {res['instagram']} mins")
                         
-                        st.success("✅ Data Logged Successfully!")
-                        del st.session_state['ocr_results']
+                        if st.button("Confirm & Save This Data"):
+                            date_str = datetime.now().strftime("%Y-%m-%d")
+                            save_logs(user, [{'date': date_str, **res}])
+                            
+                            st.success("✅ Data Logged Successfully!")
+                            del st.session_state['ocr_results']
+                            time.sleep(1.5)
+                            st.rerun()
+
+            else:
+                img_files = st.file_uploader("Upload Screenshots", type=['png', 'jpg', 'jpeg'], accept_multiple_files=True)
+
+                if img_files and st.button("Analyze All", disabled='ocr_jobs' in st.session_state):
+                    start_ocr_jobs(user, [(f.name, f.getvalue()) for f in img_files], 'bulk')
+
+                if 'bulk_results' in st.session_state:
+                    today = datetime.now().date()
+                    entries = []
+                    for i, res in enumerate(st.session_state['bulk_results']):
+                        if 'error' in res:
+                            st.error(f"**{res['name']}** OCR Error: {res['error']}")
+                            continue
+
+                        col_a, col_b = st.columns([3, 1])
+                        col_a.markdown(f"**{res['name']}**")
+                        col_a.caption(f"Total: {res['total']} mins | YouTube: {res['youtube']} mins | Instagram: {res['instagram']} mins")
+                        if res['date']:
+                            day = datetime.strptime(res['date'], "%Y-%m-%d").date()
+                        else:
+                            day = today
+                            col_a.caption("⚠️ Couldn't read a date from this screenshot, please pick it.")
+                        day = col_b.date_input("Date", value=min(day, today), max_value=today, key=f"bulk_date_{i}_{res['name']}")
+                        entries.append({'date': day.strftime("%Y-%m-%d"), 'total': res['total'], 'youtube': res['youtube'],
+                                        'instagram': res['instagram'], 'app_times': res['app_times']})
+
+                    by_date = {entry['date']: entry for entry in entries}
+                    if len(by_date) < len(entries):
+                        st.warning("Some screenshots share a date. Only the last one for each day will be saved.")
+
+                    if by_date and st.button(f"Confirm & Save {len(by_date)} Days"):
+                        save_logs(user, list(by_date.values()))
+                        st.success(f"✅ Logged {len(by_date)} days!")
+                        del st.session_state['bulk_results']
                         time.sleep(1.5)
                         st.rerun()
 
+            # Scans run in background workers and outlive reruns and page switches; this picks them back up.
+            if 'ocr_jobs' in st.session_state:
+                poll_ocr_jobs()
+
         elif menu == "Challenges":
             st.title("🏆 Active Challenges")
             today_str = datetime.now().strftime("%Y-%m-%d")
             
-            log_data = run_query("SELECT total_minutes, youtube_minutes, instagram_minutes FROM daily_logs WHERE username = ? AND date = ?", (user, today_str), fetch=True)
-            current_total = log_data[0][0] if log_data else 0
-            current_yt = log_data[0][1] if log_data else 0
-            current_insta = log_data[0][2] if log_data else 0
-            
-            completed_today_data = run_query("SELECT challenge_id FROM challenges_log WHERE username = ? AND date = ?", (user, today_str), fetch=True)
-            completed_ids_today = [x[0] for x in completed_today_data]
-
-            for cid, data in CHALLENGES.items():
-                count_data = run_query("SELECT COUNT(*) FROM challenges_log WHERE username = ? AND challenge_id = ?", (user, cid), fetch=True)
-                days_completed = count_data[0][0] if count_data else 0
+            for item in from_state(state, ('challenges', today_str), lambda: get_challenge_status(user, baseline, today_str)):
+                data = item['challenge']
+                days_completed = item['days_completed']
                 target_days = data['days']
                 
                 progress_pct = min(1.0, days_completed / target_days)
+                limit_str = f"Limit: {item['limit']}m"
+                today_val = item['today_val']
 
-                limit_str = ""
-                is_failed_today = False
-                today_val = 0
-                
-                if cid == "C1":
-                    target_min = int(baseline * 0.9)
-                    limit_str = f"Limit: {target_min}m"
-                    if current_total > target_min and current_total > 0: is_failed_today = True
-                    today_val = current_total
-                elif cid == "C2":
-                    limit_str = "Limit: 180m"
-                    if current_yt > 180: is_failed_today = True
-                    today_val = current_yt
-                elif cid == "C3":
-                    limit_str = "Limit: 120m"
-                    if current_total > 120: is_failed_today = True
-                    today_val = current_total
-                elif cid == "C4":
-                    limit_str = "Limit: 180m"
-                    if current_insta > 180: is_failed_today = True
-                    today_val = current_insta
-
-                if cid in completed_ids_today:
+                if item['done_today']:
                     today_status_msg = "✅ Day Complete"
-                elif is_failed_today:
+                elif item['failed_today']:
                     today_status_msg = f"🔴 Today Failed ({today_val}m / {limit_str})"
                 else:
                     today_status_msg = f"🟢 Today on Track ({today_val}m / {limit_str})"
@@ -430,52 +393,71 @@ def main():
                     col_a, col_b = st.columns([3, 1])
                     with col_a:
                         st.progress(progress_pct)
-                        st.caption(f"📅 Progress: **Day {days_completed}** of {target_days} | {today_status_msg}")
+                        streak_msg = f" | 🔥 {item['streak']}-day streak" if item['streak'] > 1 else ""
+                        st.caption(f"📅 Progress: **Day {days_completed}** of {target_days}{streak_msg} | {today_status_msg}")
                     
                     with col_b:
                         st.markdown(f"**{data['reward_text']}**")
-                        if days_completed >= target_days:
+                        if item['claimed']:
                             st.success("CLAIMED!")
-                        elif cid in completed_ids_today:
+                        elif item['done_today']:
                             st.info("DAY DONE")
                         else:
                             st.warning("PENDING")
                     st.divider()
 
 
+        elif menu == "Leaderboard":
+            st.title("🥇 Leaderboard")
+            col_a, col_b = st.columns(2)
+            period = col_a.radio("Period", ["This Week", "All Time"], horizontal=True)
+            board = col_b.radio("Rank By", ["Points", "Screen-time Reduction"], horizontal=True)
+            week = current_week() if period == "This Week" else ALL_TIME
+            board = 'points' if board == "Points" else 'reduction'
+
+            def show(value):
+                return f"{value} pts" if board == 'points' else f"{value:.0%}"
+
+            mine = cached_my_rank(user, state['version'], board, week)
+            if mine:
+                rank, value, ranked = mine
+                st.metric("Your Rank", f"#{rank} of {ranked}", show(value), delta_color="off")
+            else:
+                st.info("You're not on this board yet: log some days or complete a challenge!")
+
+            top = cached_leaderboard(board, week)
+            if top:
+                import pandas as pd
+                st.dataframe(pd.DataFrame([(f"#{rank}", name + (" (you)" if name == user else ""), show(value), days)
+                                           for rank, name, value, days in top],
+                                          columns=['Rank', 'User', 'Points' if board == 'points' else 'Reduction', 'Days Logged']),
+                             hide_index=True, use_container_width=True)
+                if board == 'reduction':
+                    st.caption("Reduction: share of your baseline screen time you didn't use, over the days logged.")
+
+
         elif menu == "Prediction":
             st.title("🔮 AI Screen Time Predictor")
             st.write("We use a Linear Regression model to predict your future screen time based on your history.")
             
-            data = run_query("SELECT date, total_minutes FROM daily_logs WHERE username = ? ORDER BY date", (user,), fetch=True)
+            trend = from_state(state, 'trend', lambda: get_trend_stats(user))
             
-            if len(data) < 3:
-                st.warning("⚠️ Not enough data! Please log at least 3 days of screen time to unlock predictions.")
+            if trend is None or trend[0] < MIN_DAYS_FOR_FORECAST:
+                st.warning(f"⚠️ Not enough data! Please log at least {MIN_DAYS_FOR_FORECAST} days of screen time to unlock predictions.")
             else:
-                df = pd.DataFrame(data, columns=['Date', 'Total Minutes'])
-                df['Date'] = pd.to_datetime(df['Date'])
-                df['Day_Ordinal'] = df['Date'].map(datetime.toordinal)
-                
-                X = df[['Day_Ordinal']]
-                y = df['Total Minutes']
-                model = LinearRegression()
-                model.fit(X, y)
+                days_logged, last_x = trend[0], trend[5]
+                import pandas as pd
+                import plotly.express as px
 
                 days_to_predict = st.slider("Forecast Range (Days)", 1, 7, 3)
-                max_date = df['Date'].max()
-                
-                future_dates = []
-                future_preds = []
-                
-                for i in range(1, days_to_predict + 1):
-                    next_date = max_date + timedelta(days=i)
-                    next_ord = next_date.toordinal()
-                    # Predict
-                    pred_val = model.predict([[next_ord]])[0]
-                    future_dates.append(next_date)
-                    future_preds.append(max(0, int(pred_val))) #prevents -ve min
+                forecast = forecast_from_stats(*trend)[:days_to_predict]
+                future_dates = [day for day, _ in forecast]
+                future_preds = [minutes for _, minutes in forecast]
+
+                df = pd.DataFrame(from_state(state, ('recent', last_x), lambda: get_recent_totals(user, last_x)), columns=['Date', 'Total Minutes'])
+                df['Date'] = pd.to_datetime(df['Date'])
                     
-                pred_df = pd.DataFrame({'Date': future_dates, 'Predicted Minutes': future_preds})
+                pred_df = pd.DataFrame({'Date': pd.to_datetime(future_dates), 'Predicted Minutes': future_preds})
                 
                 st.subheader(f"📅 Forecast for Next {days_to_predict} Days")
                 
@@ -487,11 +469,13 @@ def main():
                 
                 combined_df = pd.concat([history_chart, pred_chart])
                 
-                fig = px.line(combined_df, x='Date', y='Total Minutes', color='Type', markers=True, 
-                              title="Screen Time Trend & Forecast")
-                fig.update_traces(line=dict(width=3))
+                with timer("prediction.figure"):
+                    fig = px.line(combined_df, x='Date', y='Total Minutes', color='Type', markers=True, 
+                                  title="Screen Time Trend & Forecast")
+                    fig.update_traces(line=dict(width=3))
                 st.plotly_chart(fig, use_container_width=True)
                 
+                st.caption(f"Trend fitted over all {days_logged} logged days; the chart shows the last {HISTORY_WINDOW_DAYS}.")
                 st.dataframe(pred_df)
 
 
@@ -511,14 +495,11 @@ def main():
                     c1.markdown(f"#### 💰 ₹{rs}.00 Pack")
                     c1.write(f"Cost: {pts} Points")
                     if c2.button(f"Redeem ₹{rs}", key=f"redeem_{rs}"):
-                        if points >= pts:
-                            new_bal = balance + float(rs)
-                            new_pts = points - pts
-                            run_query("UPDATE users SET points = ?, balance_inr = ? WHERE username = ?", (new_pts, new_bal, user))
+                        if redeem_points(user, pts, rs):
                             st.balloons()
                             st.rerun()
                         else:
-                            st.error(f"Need {pts - points} more points!")
+                            st.error(f"Need {pts - get_user_stats(user)[0]} more points!")
 
 
         elif menu == "Withdraw Funds":
@@ -552,12 +533,18 @@ def main():
                 else:
                     with st.spinner("Connecting to Payment Gateway..."):
                         time.sleep(2) 
-                    new_balance = balance - amount
-                    run_query("UPDATE users SET balance_inr = ? WHERE username = ?", (new_balance, user))
-                    st.success(f"✅ Withdrawal of ₹{amount:.2f} Successful!")
-                    st.balloons()
-                    time.sleep(2)
-                    st.rerun()
+                    if withdraw_funds(user, amount, method):
+                        st.success(f"✅ Withdrawal of ₹{amount:.2f} Successful!")
+                        st.balloons()
+                        time.sleep(2)
+                        st.rerun()
+                    else:
+                        st.error(f"Insufficient Funds! Your balance is only ₹{get_user_stats(user)[1]:.2f}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    _run_started = time.perf_counter()
+    try:
+        main()
+    finally:
+        # Also runs when st.rerun() cuts a run short, so those count towards the page they left.
+        record(f"page.{_page}", time.perf_counter() - _run_started)
\ No newline at end of file